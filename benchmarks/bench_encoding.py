@@ -0,0 +1,78 @@
+"""
+Encoding Benchmark
+
+Measures the time to encode one event for a typical prompt and for a 50 KB
+prompt, comparing the standard library `json` with the full event dict (how
+events used to be sent) against the exporter's encoder with pre-encoded static
+fields, using orjson when installed and the standard library otherwise.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/bench_encoding.py
+"""
+
+import json
+import timeit
+from dokumetry import __encoding as encoding
+from dokumetry.__encoding import StaticFields
+
+STATIC_FIELDS = {
+    "environment": "production",
+    "applicationName": "chatbot",
+    "sourceLanguage": "python",
+    "skipResp": False,
+}
+
+def event(prompt):
+    """
+    Build the dynamic fields of a chat completions event.
+
+    Args:
+        prompt (str): Formatted prompt of the event.
+
+    Returns:
+        dict: Event fields other than the static ones.
+    """
+
+    return {
+        "endpoint": "openai.chat.completions",
+        "llmReqId": "chatcmpl-8pJ6sWkQ1Z0fPZ2nKx4QeJ0Tz9aBc",
+        "requestDuration": 1.2345678,
+        "model": "gpt-3.5-turbo",
+        "prompt": prompt,
+        "response": "The capital of France is Paris.",
+        "completionTokens": 8,
+        "promptTokens": 24,
+        "totalTokens": 32,
+        "finishReason": "stop",
+    }
+
+def per_event(function, number):
+    """
+    Return the best time of a few runs of `function`, in microseconds per call.
+    """
+
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+def main():
+    """
+    Print the encode time per event of each encoder.
+    """
+
+    static_fields = StaticFields("production", "chatbot", False)
+    prompts = {
+        "typical": "system: You are a helpful assistant.\nuser: What is the capital of France?",
+        "50 KB": "user: " + "Lorem ipsum dolor sit amet, consectetur adipiscing. " * 1000,
+    }
+    fast = "orjson" if encoding.orjson is not None else "json (orjson not installed)"
+    print(f"{'prompt':<10}{'stdlib full dict':>20}{'static fragment':>20}  encoder")
+    for name, prompt in prompts.items():
+        data = event(prompt)
+        full = {**STATIC_FIELDS, **data}
+        number = 20000 if name == "typical" else 500
+        baseline = per_event(lambda full=full: json.dumps(full).encode("utf-8"), number)
+        spliced = per_event(lambda data=data: static_fields.encode(data), number)
+        print(f"{name:<10}{baseline:>17.2f} us{spliced:>17.2f} us  {fast}")
+
+if __name__ == "__main__":
+    main()
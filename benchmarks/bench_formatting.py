@@ -0,0 +1,87 @@
+"""
+Formatting Benchmark
+
+Compares the shared message formatter with the loop each wrapper used to run
+on every call, for chat histories of 10 and 100 short messages, 10 messages
+of 20 KB each, messages with text and image items, and messages with 1 MB
+images inline as data URIs, which the shared formatter replaces by their
+type, size and hash instead of copying them into the prompt.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/bench_formatting.py
+"""
+
+import base64
+import timeit
+from dokumetry.__formatting import format_messages
+
+def per_call_loop(message_prompt):
+    """
+    Format messages the way each wrapper used to.
+    """
+
+    formatted_messages = []
+    for message in message_prompt:
+        role = message["role"]
+        content = message["content"]
+
+        if isinstance(content, list):
+            content_str = ", ".join(
+                f"{item['type']}: {item['text'] if 'text' in item else item['image_url']}"
+                if 'type' in item else f"text: {item['text']}"
+                for item in content
+            )
+            formatted_messages.append(f"{role}: {content_str}")
+        else:
+            formatted_messages.append(f"{role}: {content}")
+
+    return "\n".join(formatted_messages)
+
+def histories():
+    """
+    Build the chat histories formatted by the benchmark.
+
+    Returns:
+        dict: Messages by name of the history.
+    """
+
+    sentence = "Could you explain how the exporter batches events before sending them? "
+    image = {"type": "image_url", "image_url": "https://example.com/cat.png"}
+    data_uri = "data:image/png;base64," + base64.b64encode(bytes(1000000)).decode()
+    inline = {"type": "image_url", "image_url": data_uri}
+    return {
+        "10 text": [{"role": "user" if i % 2 == 0 else "assistant", "content": sentence * 4}
+                    for i in range(10)],
+        "100 text": [{"role": "user" if i % 2 == 0 else "assistant", "content": sentence * 4}
+                     for i in range(100)],
+        "10 x 20 KB": [{"role": "user" if i % 2 == 0 else "assistant",
+                        "content": sentence * 280} for i in range(10)],
+        "10 items": [{"role": "user", "content": [{"type": "text", "text": sentence}, image]}
+                     for _ in range(10)],
+        "10 x 1 MB": [{"role": "user", "content": [{"type": "text", "text": sentence}, inline]}
+                      for _ in range(10)],
+    }
+
+def per_call(function, number=2000):
+    """
+    Return the best time of a few runs of `function`, in microseconds per call.
+    """
+
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+def main():
+    """
+    Print the time to format each history.
+    """
+
+    print(f"{'messages':<12}{'per-call loop':>16}{'shared':>14}")
+    for name, messages in histories().items():
+        if name != "10 x 1 MB":
+            assert format_messages(messages) == per_call_loop(messages)
+        loop = per_call(lambda messages=messages: per_call_loop(messages), 200)
+        shared = per_call(lambda messages=messages: format_messages(messages), 200)
+        print(f"{name:<12}{loop:>13.2f} us{shared:>11.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Import Benchmark
+
+Measures what `import dokumetry` costs a process, from the `-X importtime`
+report of a fresh interpreter, against importing dokumetry together with the
+openai, anthropic and mistralai SDKs, which dokumetry used to import itself.
+The startup of a bare interpreter is shown for reference.
+The modules whose own code took the longest to import are listed as well.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/bench_import.py
+"""
+
+import os
+import subprocess
+import sys
+
+STATEMENTS = {
+    "interpreter only": "pass",
+    "dokumetry": "import dokumetry",
+    "dokumetry + SDKs": ("import dokumetry, openai, anthropic, mistralai.client, "
+                         "mistralai.async_client"),
+}
+
+def import_times(statement):
+    """
+    Run `statement` in a fresh interpreter and parse its `-X importtime` report.
+
+    Args:
+        statement (str): The import statement.
+
+    Returns:
+        tuple: Total microseconds of the modules imported by the statement
+        itself, and the microseconds each module spent on its own code.
+    """
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, check=False, env=os.environ)
+    total = 0
+    own = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Modules not indented were imported by the statement itself.
+        if not name.startswith("  "):
+            total += int(cumulative)
+        own[name.strip()] = int(self_time)
+    return total, own
+
+def best_of(statement, runs=5):
+    """
+    Return the import times of the fastest of a few runs of `statement`.
+    """
+
+    return min((import_times(statement) for _ in range(runs)), key=lambda times: times[0])
+
+def main():
+    """
+    Print the total import time of each statement and its slowest imports.
+    """
+
+    for label, statement in STATEMENTS.items():
+        total, own = best_of(statement)
+        print(f"{label}: {total / 1000:.1f} ms")
+        for name, self_time in sorted(own.items(), key=lambda item: -item[1])[:8]:
+            print(f"    {name:<36}{self_time / 1000:>8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Prompt Benchmark
+
+Measures the time a chat completions call spends on its prompt on the caller's
+thread, for chat histories of 10 and 100 messages: formatting the messages
+right away (how prompts used to be built) against taking the snapshot that
+the exporter formats later. The time the exporter then spends formatting and
+encoding the event is shown as well.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/bench_prompt.py
+"""
+
+import timeit
+from dokumetry.__encoding import Deferred, StaticFields
+from dokumetry.__formatting import format_messages
+
+def history(length):
+    """
+    Build a chat history of `length` messages of a few sentences each.
+    """
+
+    sentence = "Could you explain how the exporter batches events before sending them? "
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": sentence * 4}
+            for i in range(length)]
+
+def per_call(function, number):
+    """
+    Return the best time of a few runs of `function`, in microseconds per call.
+    """
+
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+def main():
+    """
+    Print the prompt time on the caller's thread and on the exporter's.
+    """
+
+    static_fields = StaticFields("production", "chatbot", False)
+    print(f"{'messages':<10}{'formatted':>14}{'deferred':>14}{'exporter':>14}")
+    for length in (10, 100):
+        kwargs = {"model": "gpt-4", "messages": history(length)}
+        eager = per_call(lambda kwargs=kwargs: format_messages(kwargs.get("messages", [])),
+                         2000)
+        deferred = per_call(lambda kwargs=kwargs: Deferred(
+            format_messages, list(kwargs.get("messages", []))), 2000)
+        prompt = Deferred(format_messages, list(kwargs["messages"]))
+        exporter = per_call(lambda prompt=prompt: static_fields.encode({"prompt": prompt}),
+                            2000)
+        print(f"{length:<10}{eager:>11.2f} us{deferred:>11.2f} us{exporter:>11.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Streaming Benchmark
+
+Streams 100k synthetic chunks through the stream wrapper of each provider and
+reports the time taken next to iterating the same chunks without dokumetry.
+The clients are fakes that replay prebuilt chunks and the collected data is
+discarded instead of being sent, so only the wrapper overhead is measured.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/bench_streaming.py
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace as Fake
+from dokumetry import openai as doku_openai, async_openai as doku_async_openai
+from dokumetry import azure_openai as doku_azure_openai
+from dokumetry import async_azure_openai as doku_async_azure_openai
+from dokumetry import anthropic as doku_anthropic, async_anthropic as doku_async_anthropic
+from dokumetry import cohere as doku_cohere
+from dokumetry import mistral as doku_mistral, async_mistral as doku_async_mistral
+
+CHUNKS = 100_000
+MESSAGES = [{"role": "user", "content": "Write a long story."}]
+# Mistral takes ChatMessage objects instead of dicts.
+MISTRAL_MESSAGES = [Fake(role="user", content="Write a long story.")]
+
+def openai_chunks():
+    """
+    Build chat and completions chunks of an OpenAI stream.
+    """
+
+    choice = Fake(delta=Fake(content="tok "), text="tok ")
+    return [Fake(id="chatcmpl-1", model="gpt-4", choices=[choice]) for _ in range(CHUNKS)]
+
+def anthropic_events():
+    """
+    Build the events of an Anthropic messages stream.
+    """
+
+    start = Fake(type="message_start", message=Fake(id="msg_1", usage=Fake(input_tokens=10)))
+    delta = Fake(type="content_block_delta", delta=Fake(text="tok "))
+    end = Fake(type="message_delta", usage=Fake(output_tokens=CHUNKS))
+    return [start] + [delta] * CHUNKS + [end]
+
+def cohere_events():
+    """
+    Build the events of a Cohere chat stream, also used for generate.
+    """
+
+    start = Fake(event_type="stream-start", generation_id="gen-1", text="")
+    delta = Fake(event_type="text-generation", text="tok ")
+    return [start] + [delta] * CHUNKS
+
+def mistral_events():
+    """
+    Build the events of a Mistral chat stream.
+    """
+
+    usage = Fake(prompt_tokens=10, completion_tokens=CHUNKS, total_tokens=CHUNKS + 10)
+    events = [Fake(id="cmpl-1", usage=None, choices=[Fake(delta=Fake(content="tok "),
+                                                           finish_reason=None)])
+              for _ in range(CHUNKS)]
+    events[-1] = Fake(id="cmpl-1", usage=usage, choices=[Fake(delta=Fake(content="tok "),
+                                                               finish_reason="stop")])
+    return events
+
+def unused(*_args, **_kwargs):
+    """
+    Stand in for the client methods a benchmark does not call.
+    """
+
+def streaming_method(items, is_async):
+    """
+    Build a client method that returns a stream of `items`.
+    """
+
+    if is_async:
+        async def create(*_args, **_kwargs):
+            return iterate_async(items)
+        return create
+    return lambda *_args, **_kwargs: iter(items)
+
+def openai_client(chunks, is_async):
+    """
+    Build a fake OpenAI client whose create methods stream `chunks`.
+    """
+
+    create = streaming_method(chunks, is_async)
+    return Fake(chat=Fake(completions=Fake(create=create)), completions=Fake(create=create),
+                embeddings=Fake(create=unused), fine_tuning=Fake(jobs=Fake(create=unused)),
+                images=Fake(generate=unused, create_variation=unused),
+                audio=Fake(speech=Fake(create=unused)))
+
+async def iterate_async(items):
+    """
+    Yield `items` from an async generator.
+    """
+
+    for item in items:
+        yield item
+
+def wrappers():
+    """
+    Build each provider's stream wrapper around a fake client.
+
+    Returns:
+        list: Tuples of a name, the chunks, the call returning the stream and
+        whether the stream is async.
+    """
+
+    cases = []
+    for module, name, is_async in ((doku_openai, "openai", False),
+                                   (doku_async_openai, "async_openai", True),
+                                   (doku_azure_openai, "azure_openai", False),
+                                   (doku_async_azure_openai, "async_azure_openai", True)):
+        chunks = openai_chunks()
+        llm = openai_client(chunks, is_async)
+        module.init(llm, "http://localhost", "key", "benchmark", "benchmark", False)
+        cases.append((f"{name} chat", chunks, lambda llm=llm: llm.chat.completions.create(
+            model="gpt-4", messages=MESSAGES, stream=True), is_async))
+        cases.append((f"{name} completions", chunks, lambda llm=llm: llm.completions.create(
+            model="gpt-3.5-turbo-instruct", prompt="Write a long story.", stream=True),
+                      is_async))
+
+    for module, name, is_async in ((doku_anthropic, "anthropic", False),
+                                   (doku_async_anthropic, "async_anthropic", True)):
+        events = anthropic_events()
+        llm = Fake(messages=Fake(create=streaming_method(events, is_async)))
+        module.init(llm, "http://localhost", "key", "benchmark", "benchmark", False)
+        cases.append((f"{name} messages", events, lambda llm=llm: llm.messages.create(
+            model="claude-3-opus", messages=MESSAGES, stream=True), is_async))
+
+    events = cohere_events()
+    llm = Fake(generate=streaming_method(events, False), chat=streaming_method(events, False),
+               embed=unused, chat_stream=unused, summarize=unused)
+    doku_cohere.init(llm, "http://localhost", "key", "benchmark", "benchmark", False)
+    cases.append(("cohere generate", events, lambda llm=llm: llm.generate(
+        prompt="Write a long story.", stream=True), False))
+    cases.append(("cohere chat", events, lambda llm=llm: llm.chat(
+        message="Write a long story.", stream=True), False))
+
+    events = mistral_events()
+    llm = Fake(chat=unused, chat_stream=streaming_method(events, False), embeddings=unused)
+    doku_mistral.init(llm, "http://localhost", "key", "benchmark", "benchmark", False)
+    cases.append(("mistral chat_stream", events, lambda llm=llm: llm.chat_stream(
+        model="mistral-large", messages=MISTRAL_MESSAGES), False))
+    llm = Fake(chat=unused, chat_stream=lambda *_args, **_kwargs: iterate_async(events),
+               embeddings=unused)
+    doku_async_mistral.init(llm, "http://localhost", "key", "benchmark", "benchmark", False)
+    cases.append(("async_mistral chat_stream", events, lambda llm=llm: llm.chat_stream(
+        model="mistral-large", messages=MISTRAL_MESSAGES), True))
+    return cases
+
+async def consume_async(stream):
+    """
+    Iterate an async stream to its end.
+    """
+
+    async for _ in await stream if asyncio.iscoroutine(stream) else stream:
+        pass
+
+def timed(function):
+    """
+    Return the seconds taken by `function`.
+    """
+
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def main():
+    """
+    Print the time to stream all chunks through each wrapper.
+    """
+
+    def discard(*_args, **_kwargs):
+        pass
+
+    async def discard_async(*_args, **_kwargs):
+        pass
+
+    for module in (doku_openai, doku_azure_openai, doku_anthropic, doku_cohere, doku_mistral):
+        module.send_data = discard
+    for module in (doku_async_openai, doku_async_azure_openai, doku_async_anthropic,
+                   doku_async_mistral):
+        module.send_data_async = discard_async
+
+    print(f"{'wrapper':<30}{'without':>12}{'with':>12}{'per chunk':>14}")
+    for name, chunks, call, is_async in wrappers():
+        if is_async:
+            baseline = timed(lambda chunks=chunks: asyncio.run(
+                consume_async(iterate_async(chunks))))
+            wrapped = timed(lambda call=call: asyncio.run(consume_async(call())))
+        else:
+            baseline = timed(lambda chunks=chunks: [None for _ in iter(chunks)])
+            wrapped = timed(lambda call=call: [None for _ in call()])
+        overhead = (wrapped - baseline) / len(chunks) * 1e9
+        print(f"{name:<30}{baseline * 1e3:>9.1f} ms{wrapped * 1e3:>9.1f} ms"
+              f"{overhead:>11.0f} ns")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+This module has the circuit breaker that guards requests to Doku.
+"""
+
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# pylint: disable=too-many-instance-attributes
+class CircuitBreaker:
+    """
+    Circuit breaker with jittered exponential backoff.
+
+    The breaker opens after `failure_threshold` consecutive failures. While open,
+    requests are refused until the backoff delay has passed, then a single probe
+    is let through (half open). A successful probe closes the breaker, a failed
+    one opens it again with twice the delay, up to `max_delay`.
+    """
+
+    def __init__(self, failure_threshold=5, base_delay=1.0, max_delay=60.0):
+        """
+        Initialize the circuit breaker.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the breaker.
+            base_delay (float): Backoff in seconds after the breaker first opens.
+            max_delay (float): Maximum backoff in seconds.
+        """
+
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = CLOSED
+        self.failures = 0
+        self._attempts = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Tell whether a request may be sent now.
+
+        Returns:
+            bool: True if the breaker is closed, or open with the backoff elapsed,
+            in which case the caller's request is the probe.
+        """
+
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._retry_at:
+                self.state = HALF_OPEN
+                # Allow another probe should this one never report back.
+                self._retry_at = now + self.max_delay
+                return True
+        return False
+
+    def after_fork_in_child(self):
+        """
+        Replace the lock, which may have been held by another thread at fork time.
+        """
+
+        self._lock = threading.Lock()
+
+    def record_success(self):
+        """
+        Record a request Doku answered, which closes the breaker.
+        """
+
+        if self.state == CLOSED and self.failures == 0:
+            return
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._attempts = 0
+
+    def record_failure(self):
+        """
+        Record a request that failed, which may open the breaker.
+        """
+
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._attempts += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (self._attempts - 1))
+                # Equal jitter keeps processes restarted together from probing in lockstep.
+                self._retry_at = time.monotonic() + delay / 2 + random.uniform(0, delay / 2)
+                self.state = OPEN
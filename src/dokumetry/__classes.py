@@ -0,0 +1,200 @@
+"""
+This module has the class-level instrumentation, which patches the classes of
+an LLM client and its resources once per process instead of every client.
+"""
+
+import inspect
+import threading
+
+# Header the OpenAI and Anthropic SDKs add to requests made through
+# `with_raw_response` and `with_streaming_response`, whose responses the
+# instrumentations cannot read.
+RAW_RESPONSE_HEADER = "X-Stainless-Raw-Response"
+
+# Attribute of a client holding the patches of its own configuration.
+CONFIG_ATTRIBUTE = "_dokumetry_patches"
+
+_lock = threading.Lock()
+# Original function of each patched (class, name).
+_originals = {}
+# Patched (class, name) defined by the class itself rather than a base class.
+_own = set()
+# Patched (class, name) by client class.
+_by_client_class = {}
+# Patches by configuration.
+_patches = {}
+# Patches of clients without a configuration of their own, by client class.
+_defaults = {}
+# Defaults found for each class of the clients called, see `_defaults_of`.
+_resolved = {}
+
+class _Recorder:
+    """
+    Stands in for a client, or one of its resources, while an instrumentation
+    patches it. The instrumentation gets the functions of the classes as the
+    originals, and its patches are recorded by class instead of being set.
+    """
+
+    def __init__(self, target, patches):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_recorded", patches)
+
+    def __getattr__(self, name):
+        cls = type(self._target)
+        if (cls, name) in _originals:
+            return _originals[(cls, name)]
+        if inspect.isfunction(inspect.getattr_static(cls, name, None)):
+            return getattr(cls, name)
+        return _Recorder(getattr(self._target, name), self._recorded)
+
+    def __setattr__(self, name, value):
+        self._recorded[(type(self._target), name)] = value
+
+def _dispatcher(key, original, wrapper, on_client):
+    # Functions of the client class itself are called on the client, whose own
+    # `_client`, if any, is its HTTP client, as in the Mistral SDK.
+    def lookup(resource, kwargs):
+        headers = kwargs.get("extra_headers")
+        if headers and RAW_RESPONSE_HEADER in headers:
+            return original
+        client = resource if on_client else getattr(resource, "_client", resource)
+        patches = getattr(client, CONFIG_ATTRIBUTE, None)
+        if patches is None:
+            try:
+                patches = _resolved[type(client)]
+            except KeyError:
+                patches = _defaults_of(type(client))
+        return patches.get(key, original)
+
+    if inspect.iscoroutinefunction(wrapper):
+        async def dispatch_async(self, *args, **kwargs):
+            return await lookup(self, kwargs)(self, *args, **kwargs)
+        dispatch = dispatch_async
+    else:
+        def dispatch(self, *args, **kwargs):
+            return lookup(self, kwargs)(self, *args, **kwargs)
+    dispatch.__name__ = original.__name__
+    dispatch.__qualname__ = original.__qualname__
+    dispatch.__doc__ = original.__doc__
+    dispatch.__wrapped__ = original
+    return dispatch
+
+def _instrumented_class(client_class):
+    # Resource classes are shared between SDK clients, e.g. by OpenAI and
+    # AzureOpenAI. A client class only shares the patches of its base classes up
+    # to the one its instrumentation is registered for.
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from .__registry import registered_class
+    last = registered_class(client_class)
+    for cls in client_class.__mro__:
+        if cls in _by_client_class:
+            return cls
+        if cls is last:
+            break
+    return None
+
+def _defaults_of(client_class):
+    found = _instrumented_class(client_class)
+    patches = _defaults.get(found, {})
+    _resolved[client_class] = patches
+    return patches
+
+def instrument_classes(llm, init_function, args, options):
+    """
+    Patch the classes of an LLM client and of its resources, once per process.
+
+    Every client of the class of `llm`, or of its subclasses, including those
+    created later, is then instrumented with the configuration of the first
+    call. Clients of other classes sharing the resource classes, e.g. AzureOpenAI
+    clients for OpenAI, keep calling the original functions. Later calls with
+    another configuration apply it to `llm` only, through an attribute looked
+    up on each call. The patches of each configuration are built once.
+
+    Args:
+        llm: The LLM client.
+        init_function (function): The instrumentation of the client's class.
+        args (tuple): Positional arguments of `init_function` after the client.
+        options (dict): Keyword arguments of `init_function`.
+    """
+
+    config = (init_function, args, tuple(sorted(options.items())))
+    client_class = type(llm)
+    with _lock:
+        patches = _patches.get(config)
+        if patches is None:
+            patches = {}
+            init_function(_Recorder(llm, patches), *args, **options)
+            _patches[config] = patches
+        for (cls, name), wrapper in patches.items():
+            if (cls, name) not in _originals:
+                _originals[(cls, name)] = getattr(cls, name)
+                if name in vars(cls):
+                    _own.add((cls, name))
+                setattr(cls, name, _dispatcher((cls, name), _originals[(cls, name)], wrapper,
+                                               cls is client_class))
+        _by_client_class.setdefault(client_class, set()).update(patches)
+        defaults = _defaults.setdefault(client_class, {})
+        for key, wrapper in patches.items():
+            defaults.setdefault(key, wrapper)
+        _resolved.clear()
+        is_default = all(defaults[key] is wrapper for key, wrapper in patches.items())
+    if is_default:
+        vars(llm).pop(CONFIG_ATTRIBUTE, None)
+    else:
+        setattr(llm, CONFIG_ATTRIBUTE, patches)
+
+def is_instrumented(llm):
+    """
+    Return whether the classes of an LLM client are instrumented.
+
+    Args:
+        llm: The LLM client.
+
+    Returns:
+        bool: True if `instrument_classes` patched the classes of a client of
+        the same class, or of one of its base classes sharing its instrumentation.
+    """
+
+    return _instrumented_class(type(llm)) is not None
+
+def forget_resolved():
+    """
+    Drop the defaults found for each client class, after the registry changed.
+    """
+
+    _resolved.clear()
+
+def uninstrument_classes(llm):
+    """
+    Stop tracking the clients of the class of an LLM client through its classes.
+
+    Only the patches made for that class are undone, not those of its base
+    classes. Functions still patched for other client classes stay patched,
+    e.g. those of the resource classes OpenAI and AzureOpenAI share.
+
+    Args:
+        llm: The LLM client.
+
+    Returns:
+        bool: True if `instrument_classes` was called for a client of this class.
+    """
+
+    vars(llm).pop(CONFIG_ATTRIBUTE, None)
+    with _lock:
+        keys = _by_client_class.pop(type(llm), None)
+        if keys is None:
+            return False
+        _defaults.pop(type(llm), None)
+        _resolved.clear()
+        in_use = set().union(*_by_client_class.values())
+        for cls, name in keys - in_use:
+            original = _originals.pop((cls, name))
+            if (cls, name) in _own:
+                _own.discard((cls, name))
+                setattr(cls, name, original)
+            else:
+                delattr(cls, name)
+        for config, patches in list(_patches.items()):
+            if not in_use.issuperset(patches):
+                del _patches[config]
+    return True
@@ -0,0 +1,116 @@
+"""
+This module has the JSON encoding used for events sent to Doku.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pylint: disable=too-few-public-methods
+class Deferred:
+    """
+    A value of an event computed by the exporter when the event is encoded.
+
+    Lets the wrappers hand over a cheap snapshot of their inputs, e.g. the chat
+    messages, and leave the formatting to the exporter's thread instead of the
+    caller's.
+    """
+
+    __slots__ = ("function", "args")
+
+    def __init__(self, function, *args):
+        """
+        Initialize the deferred value.
+
+        Args:
+            function (callable): Computes the value from `args`.
+            *args: Arguments passed to `function`.
+        """
+
+        self.function = function
+        self.args = args
+
+    def resolve(self):
+        """
+        Compute the value.
+
+        Returns:
+            The value returned by the function.
+        """
+
+        return self.function(*self.args)
+
+def _default(value):
+    if isinstance(value, Deferred):
+        return value.resolve()
+    return str(value)
+
+def dumps(data):
+    """
+    Encode data as compact single-line JSON.
+
+    orjson is used when installed, the standard library otherwise. `Deferred`
+    values are resolved, other values JSON has no type for are encoded as their
+    string form.
+
+    Args:
+        data (dict): Data to be encoded.
+
+    Returns:
+        bytes: The encoded data.
+    """
+
+    if orjson is not None:
+        # pylint: disable=no-member
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_default, separators=(",", ":")).encode("utf-8")
+
+# pylint: disable=too-few-public-methods
+class StaticFields:
+    """
+    Fields shared by every event of an instrumented client, encoded once.
+
+    The wrappers leave these fields out of their event dicts and the exporter
+    splices the pre-encoded fragment into each encoded event.
+    """
+
+    def __init__(self, environment, application_name, skip_resp, capture_response=True):
+        """
+        Initialize the static fields.
+
+        Args:
+            environment (str): Doku environment.
+            application_name (str): Doku application name.
+            skip_resp (bool): Skip response processing.
+            capture_response (bool): Send the response of the LLM to Doku.
+        """
+
+        # Not a field, read by `send_data` to leave responses out.
+        self.capture_response = capture_response
+        self.fields = {
+            "environment": environment,
+            "applicationName": application_name,
+            "sourceLanguage": "python",
+            "skipResp": skip_resp,
+        }
+        # The encoded object without its closing brace, ready to be extended.
+        self.prefix = dumps(self.fields)[:-1]
+
+    def encode(self, data):
+        """
+        Encode an event with the static fields.
+
+        Args:
+            data (dict): Event fields other than the static ones.
+
+        Returns:
+            bytes: The encoded event.
+        """
+
+        encoded = dumps(data)
+        if encoded == b"{}":
+            return self.prefix + b"}"
+        return self.prefix + b"," + encoded[1:]
@@ -0,0 +1,1030 @@
+"""
+This module has the background exporter that ships data to Doku.
+"""
+
+# pylint: disable=too-many-lines
+
+import asyncio
+import atexit
+import errno
+import functools
+import gzip
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from .__breaker import CircuitBreaker, CLOSED
+from .__encoding import dumps
+from .__spool import Spool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+@functools.lru_cache(maxsize=None)
+def import_httpx():
+    """
+    Import httpx on first use, as importing it takes about a tenth of a second.
+
+    Returns:
+        module: httpx, None if it is not installed.
+    """
+
+    try:
+        import httpx # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return httpx
+
+def http2_available():
+    """
+    Tell whether httpx can send requests over HTTP/2.
+
+    Returns:
+        bool: True if httpx and h2 are installed.
+    """
+
+    try:
+        import h2 # pylint: disable=import-outside-toplevel, unused-import
+    except ImportError:
+        return False
+    return import_httpx() is not None
+
+# Errors of a push to Doku with requests.
+HTTP_ERRORS = (requests.exceptions.RequestException,)
+
+# Largest datagram sent to a local agent, small enough for UDP. Larger events
+# are pushed to Doku itself, or dropped without a Doku URL.
+MAX_DATAGRAM_BYTES = 65000
+
+# pylint: disable=too-few-public-methods
+class _Marker:
+    """
+    Control item put on the exporter queue to request a flush or a stop.
+    """
+
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+# pylint: disable=too-many-instance-attributes
+class Exporter:
+    """
+    Background exporter that batches data and ships it to Doku.
+
+    The patched LLM methods only put their data on a bounded in-memory queue.
+    A daemon worker thread drains the queue and flushes a batch once it holds
+    `batch_size` events or its oldest event is `flush_interval` seconds old.
+    """
+
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def __init__(self, doku_url, api_key, batch_size=100, flush_interval=1.0,
+                 max_queue_size=10000, pool_size=10, http2=False, bulk_push=False,
+                 max_batch_bytes=1000000, compression=None, compression_threshold=1024,
+                 spool_dir=None, replay_concurrency=4, replay_interval=30.0, timeout=10.0,
+                 failure_threshold=5, max_backoff=60.0, agent_url=None):
+        """
+        Initialize the exporter.
+
+        Args:
+            doku_url (str): Doku URL.
+            api_key (str): Doku Authentication api_key.
+            batch_size (int): Maximum number of events flushed together.
+            flush_interval (float): Maximum age in seconds of a pending batch.
+            max_queue_size (int): Events buffered before new ones are dropped.
+            pool_size (int): Keep-alive connections kept open to Doku.
+            http2 (bool): Multiplex requests over HTTP/2 (needs `httpx[http2]`).
+            bulk_push (bool): Send each batch as one JSON array instead of one
+                request per event. Needs a Doku Ingester that accepts arrays.
+            max_batch_bytes (int): Maximum body size of a bulk push request.
+            compression (str): Compress request bodies with "gzip" or "zstd"
+                (needs `zstandard`), None to send them as is.
+            compression_threshold (int): Bodies smaller than this many bytes are
+                sent uncompressed.
+            spool_dir (str): Directory where events Doku could not accept are kept
+                until they can be replayed, None to drop them.
+            replay_concurrency (int): Maximum push requests in flight while replaying.
+            replay_interval (float): Seconds between replay attempts while Doku is down.
+            timeout (float): Seconds to wait for Doku to answer a request.
+            failure_threshold (int): Consecutive failed requests after which the
+                circuit breaker opens and events are spooled or dropped unsent.
+            max_backoff (float): Maximum seconds between probes while the breaker is open.
+            agent_url (str): Send events to a local `dokumetry-agent` at
+                "unix:///path/to/socket" or "udp://127.0.0.1:port" instead of Doku.
+                Events larger than `MAX_DATAGRAM_BYTES` are pushed to `doku_url`.
+        """
+
+        # The arguments as given, before falling back for missing packages.
+        self.options = {name: value for name, value in locals().items() if name != "self"}
+        self.doku_url = doku_url
+        self.api_key = api_key
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.pool_size = pool_size
+        self.http2 = http2
+        self.bulk_push = bulk_push
+        self.max_batch_bytes = max_batch_bytes
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.spool_dir = spool_dir
+        self.replay_concurrency = replay_concurrency
+        self.replay_interval = replay_interval
+        self.spool = Spool(spool_dir) if spool_dir else None
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, max_delay=max_backoff)
+        self.agent_url = agent_url
+        if agent_url:
+            agent_address(agent_url)
+        if compression == "zstd" and zstandard is None:
+            logging.warning("DokuMetry: zstd compression needs `pip install zstandard`, using gzip")
+            self.compression = "gzip"
+        elif compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unsupported compression: {compression}")
+        if http2 and not http2_available():
+            logging.warning("DokuMetry: HTTP/2 needs `pip install httpx[http2]`, using HTTP/1.1")
+            self.http2 = False
+        self._http_errors = HTTP_ERRORS
+        if self.http2:
+            self._http_errors += (import_httpx().HTTPError,)
+        # Errors of a push to Doku or a datagram to a local agent.
+        self._send_errors = self._http_errors + (OSError,)
+        self.push_url = (doku_url or "").rstrip("/") + "/api/push"
+        self.headers = {
+            'Authorization': api_key,
+            'Content-Type': 'application/json',
+        }
+        self._compressed_headers = dict(self.headers, **{'Content-Encoding': self.compression})
+        self._reset()
+
+    def _reset(self):
+        self.dropped = 0
+        self.undelivered = 0
+        self.oversized = 0
+        self.uncompressed_bytes = 0
+        self.sent_bytes = 0
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._session = None
+        self._direct_session = None
+        self._replay_wakeup = threading.Event()
+        self._replay_stopped = False
+        self._replayer = None
+        self._loop_exporters = {}
+
+    def after_fork_in_child(self):
+        """
+        Rebuild the queue, worker thread and connection pool in a forked child.
+
+        Only the forking thread survives a fork, so the inherited worker is gone and
+        locks may be stuck. Data queued before the fork is discarded here because
+        the parent still sends it, and the parent's connections and spool segment
+        are left alone. The worker and pool are recreated on the next `enqueue`.
+        """
+
+        self._reset()
+        self.breaker.after_fork_in_child()
+        if self.spool is not None:
+            self.spool.after_fork_in_child()
+
+    def enqueue(self, data, static_fields=None):
+        """
+        Queue data for export without blocking the caller.
+
+        Args:
+            data (dict): Data to be sent.
+            static_fields (StaticFields): Pre-encoded fields to add to the data.
+
+        Returns:
+            bool: False if the queue was full and the data was dropped.
+        """
+
+        if self._worker is None:
+            self._start()
+        if static_fields is not None:
+            data = (static_fields, data)
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self.count_dropped()
+            return False
+        return True
+
+    def enqueue_async(self, data, static_fields=None):
+        """
+        Queue data for export from a coroutine without blocking the event loop.
+
+        Each running event loop gets its own `AsyncExporter`. Without httpx, or
+        when sending to a local agent, the data goes to the thread-backed queue
+        instead, which is also non-blocking.
+
+        Args:
+            data (dict): Data to be sent.
+            static_fields (StaticFields): Pre-encoded fields to add to the data.
+
+        Returns:
+            bool: False if the queue was full and the data was dropped.
+        """
+
+        if self.agent_url:
+            return self.enqueue(data, static_fields)
+        loop = asyncio.get_running_loop()
+        loop_exporter = self._loop_exporters.get(loop)
+        if loop_exporter is None:
+            if import_httpx() is None:
+                return self.enqueue(data, static_fields)
+            loop_exporter = self._add_loop_exporter(loop)
+        return loop_exporter.enqueue(data, static_fields)
+
+    def stats(self):
+        """
+        Return export statistics.
+
+        Returns:
+            dict: Events dropped on full queues, events Doku did not accept that
+            could not be spooled, events too large for the agent dropped for lack
+            of a Doku URL, body bytes before and after compression, the
+            compression ratio achieved so far and the circuit breaker state.
+        """
+
+        return {
+            "dropped": self.dropped,
+            "undelivered": self.undelivered,
+            "oversized": self.oversized,
+            "circuit_state": self.breaker.state,
+            "uncompressed_bytes": self.uncompressed_bytes,
+            "sent_bytes": self.sent_bytes,
+            "compression_ratio": (self.uncompressed_bytes / self.sent_bytes
+                                  if self.sent_bytes else 1.0),
+        }
+
+    def count_dropped(self):
+        """
+        Record an event dropped because a queue was full.
+        """
+
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logging.warning("DokuMetry: Export queue is full, %d events dropped so far",
+                            self.dropped)
+
+    def _add_loop_exporter(self, loop):
+        with self._lock:
+            closed = [self._loop_exporters.pop(other)
+                      for other in list(self._loop_exporters) if other.is_closed()]
+            loop_exporter = AsyncExporter(self)
+            self._loop_exporters[loop] = loop_exporter
+        for other in closed:
+            other.hand_off()
+        return loop_exporter
+
+    def hand_off_loop_exporters(self, timeout=None):
+        """
+        Move data queued on event loops to the thread-backed queue.
+
+        Loops running in other threads are asked to flush instead, so data already
+        being sent there is not sent twice.
+
+        Args:
+            timeout (float): Seconds to wait for each running loop, None to wait forever.
+        """
+
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+        for loop, loop_exporter in list(self._loop_exporters.items()):
+            if loop.is_running() and loop is not current_loop:
+                future = asyncio.run_coroutine_threadsafe(loop_exporter.flush(), loop)
+                try:
+                    future.result(timeout)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    future.cancel()
+            else:
+                loop_exporter.hand_off()
+
+    def flush(self, timeout=None):
+        """
+        Send everything queued so far.
+
+        Args:
+            timeout (float): Seconds to wait for the flush, None to wait forever.
+
+        Returns:
+            bool: True if the queued data was handed to Doku within the timeout.
+        """
+
+        self.hand_off_loop_exporters(timeout)
+        return self._send_marker(_Marker(), timeout)
+
+    def shutdown(self, timeout=None):
+        """
+        Flush the queue and stop the worker thread.
+
+        Args:
+            timeout (float): Seconds to wait for the flush, None to wait forever.
+
+        Returns:
+            bool: True if the worker stopped within the timeout.
+        """
+
+        self.hand_off_loop_exporters(timeout)
+        return self._send_marker(_Marker(stop=True), timeout)
+
+    def _send_marker(self, marker, timeout):
+        if self._worker is None:
+            return True
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def start(self):
+        """
+        Start the worker thread, which opens a connection to Doku right away.
+
+        Called from `dokumetry.init` so that DNS, TCP and TLS setup does not
+        delay the first batch.
+        """
+
+        self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                worker = threading.Thread(target=self._run, name="dokumetry-exporter",
+                                          daemon=True)
+                worker.start()
+                self._worker = worker
+
+    def _run(self):
+        if self._session is None:
+            self._session = self._new_session()
+            self._warm_up()
+        if self.spool is not None:
+            self._replay_stopped = False
+            self._replayer = threading.Thread(target=self._replay, name="dokumetry-replayer",
+                                              daemon=True)
+            self._replayer.start()
+            self._replay_wakeup.set()
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Marker):
+                self._export(batch)
+                batch, deadline = [], None
+                if item.stop:
+                    if self.spool is not None:
+                        self._replay_stopped = True
+                        self._replay_wakeup.set()
+                        # Let the replayer finish the segment it is sending.
+                        self._replayer.join()
+                        self.spool.close()
+                    self._session.close()
+                    self._session = None
+                    if self._direct_session is not None:
+                        self._direct_session.close()
+                        self._direct_session = None
+                    self._worker = None
+                    item.done.set()
+                    return
+                item.done.set()
+                continue
+
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size and time.monotonic() < deadline:
+                    continue
+
+            self._export(batch)
+            batch, deadline = [], None
+
+    def _new_session(self):
+        if self.agent_url:
+            return AgentSocket(self.agent_url)
+        if self.http2:
+            httpx = import_httpx()
+            limits = httpx.Limits(max_connections=self.pool_size,
+                                  max_keepalive_connections=self.pool_size)
+            return httpx.Client(http2=True, limits=limits)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _warm_up(self):
+        # Any answer will do, this only sets up a pooled keep-alive connection.
+        if self.agent_url:
+            return
+        try:
+            self._session.head(self.doku_url, headers=self.headers, timeout=self.timeout)
+        except self._http_errors as err:
+            logging.debug("DokuMetry: Could not connect to Doku: %s", err)
+
+    def encode(self, batch):
+        """
+        Encode a batch of data as JSON.
+
+        Data queued with static fields gets their pre-encoded fragment spliced in.
+
+        Args:
+            batch (list): Data to be sent.
+
+        Returns:
+            list: Events encoded as single-line JSON bytes.
+        """
+
+        events = []
+        for data in batch:
+            if isinstance(data, bytes):
+                # Already encoded, e.g. received by a local agent.
+                events.append(data)
+                continue
+            # Deferred values run wrapper code here, don't let it stop the worker.
+            # pylint: disable=broad-exception-caught
+            try:
+                if isinstance(data, tuple):
+                    static_fields, data = data
+                    events.append(static_fields.encode(data))
+                else:
+                    events.append(dumps(data))
+            except Exception as err:
+                logging.error("DokuMetry: Error encoding data for Doku: %s", err)
+        return events
+
+    def group(self, events):
+        """
+        Split encoded events into the groups sent by one push request each.
+
+        In bulk mode a group holds at most `batch_size` events and `max_batch_bytes`
+        bytes, otherwise every event is a group of its own. For a local agent a
+        group fills one datagram.
+
+        Args:
+            events (list): Encoded events.
+
+        Returns:
+            list: Lists of encoded events.
+        """
+
+        if self.agent_url:
+            return pack_events(events, self.batch_size, MAX_DATAGRAM_BYTES)
+        if not self.bulk_push:
+            return [[event] for event in events]
+        return pack_events(events, self.batch_size, self.max_batch_bytes)
+
+    def body(self, group):
+        """
+        Build the push request body for a group of encoded events.
+
+        Datagrams for a local agent hold one event per line.
+        """
+
+        if self.agent_url:
+            return b"\n".join(group)
+        if not self.bulk_push:
+            return group[0]
+        return b"[" + b",".join(group) + b"]"
+
+    def compress(self, body):
+        """
+        Compress a request body if compression is enabled and it is large enough.
+
+        Args:
+            body (bytes): Encoded request body.
+
+        Returns:
+            tuple: The body to send and the request headers to send it with.
+        """
+
+        self.uncompressed_bytes += len(body)
+        if self.compression is None or len(body) < self.compression_threshold:
+            self.sent_bytes += len(body)
+            return body, self.headers
+        if self.compression == "zstd":
+            compressed = zstandard.ZstdCompressor().compress(body)
+        else:
+            compressed = gzip.compress(body, compresslevel=6)
+        self.sent_bytes += len(compressed)
+        logging.debug("DokuMetry: Compressed %d bytes to %d bytes (%.1fx)",
+                      len(body), len(compressed), len(body) / max(1, len(compressed)))
+        return compressed, self._compressed_headers
+
+    def spool_events(self, events):
+        """
+        Keep events Doku could not accept in the spool, or drop them without one.
+
+        Args:
+            events (list): Encoded events.
+        """
+
+        if not events:
+            return
+        if self.spool is not None:
+            try:
+                if self.spool.append(events):
+                    return
+            except OSError as err:
+                # E.g. a full disk, or the directory was removed.
+                logging.error("DokuMetry: Could not write to spool %s: %s",
+                              self.spool.directory, err)
+        self.undelivered += len(events)
+        logging.warning("DokuMetry: Dropped %d events Doku did not accept, %d so far",
+                        len(events), self.undelivered)
+
+    def replay_pending(self):
+        """
+        Wake the replayer to send spooled events, e.g. after Doku accepted a request.
+        """
+
+        if self.spool is not None:
+            self._replay_wakeup.set()
+
+    def _export(self, batch):
+        failed = []
+        for group in self.group(self.encode(batch)):
+            # An open circuit breaker fails the remaining groups without sending.
+            if not self._try_send(group):
+                failed.extend(group)
+        self.spool_events(failed)
+        if not failed:
+            self.replay_pending()
+
+    def _try_send(self, group):
+        """
+        Push a group of events unless the circuit breaker is open.
+
+        Returns:
+            bool: False if the events should be retried later.
+        """
+
+        if not self.breaker.allow():
+            return False
+        # pylint: disable=broad-exception-caught
+        try:
+            self._post(self.body(group))
+        except self._send_errors as http_err:
+            logging.error("DokuMetry: Error sending data to Doku: %s", http_err)
+            return self.record_result(http_err)
+        except Exception as err:
+            logging.error("DokuMetry: Error exporting data to Doku: %s", err)
+        self.breaker.record_success()
+        return True
+
+    def record_result(self, http_err):
+        """
+        Update the circuit breaker after a failed push.
+
+        Args:
+            http_err (Exception): Error raised by the HTTP client.
+
+        Returns:
+            bool: False if the events should be retried later.
+        """
+
+        if is_retryable(http_err):
+            self.breaker.record_failure()
+            return False
+        # Doku answered, it just did not accept these events.
+        self.breaker.record_success()
+        return True
+
+    def _post(self, body):
+        if self.agent_url:
+            if len(body) <= MAX_DATAGRAM_BYTES:
+                self._session.send(body)
+            else:
+                self._post_oversized(body)
+            return
+        body, headers = self.compress(body)
+        if self.http2:
+            response = self._session.post(self.push_url, content=body,
+                                          headers=headers, timeout=self.timeout)
+        else:
+            response = self._session.post(self.push_url, data=body,
+                                          headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+    def _post_oversized(self, event):
+        """
+        Push an event too large for a datagram to Doku itself, bypassing the agent.
+
+        Without a Doku URL the event is dropped and counted in `oversized`.
+
+        Args:
+            event (bytes): The encoded event.
+        """
+
+        if not self.doku_url:
+            self.oversized += 1
+            logging.warning("DokuMetry: Dropped an event of %d bytes, too large for the agent, "
+                            "%d so far", len(event), self.oversized)
+            return
+        with self._lock:
+            if self._direct_session is None:
+                self._direct_session = requests.Session()
+        body, headers = self.compress(event)
+        response = self._direct_session.post(self.push_url, data=body, headers=headers,
+                                             timeout=self.timeout)
+        response.raise_for_status()
+
+    def _replay(self):
+        while not self._replay_stopped:
+            self._replay_wakeup.wait(self.replay_interval)
+            self._replay_wakeup.clear()
+            if self._replay_stopped or self._session is None or self.breaker.state != CLOSED:
+                continue
+            path = self.spool.claim()
+            while path is not None and not self._replay_stopped:
+                groups = self.group(self.spool.read(path))
+                with ThreadPoolExecutor(max_workers=self.replay_concurrency) as pool:
+                    sent = list(pool.map(self._try_send, groups))
+                self.spool_events([event for group, ok in zip(groups, sent) if not ok
+                                   for event in group])
+                self.spool.release(path)
+                path = None if False in sent else self.spool.claim()
+
+def is_retryable(err):
+    """
+    Tell whether a failed push may succeed later.
+
+    Connection errors, timeouts, rate limiting and server errors are retryable,
+    other client errors such as a wrong api_key are not.
+
+    Args:
+        err (Exception): Error raised by the HTTP client.
+
+    Returns:
+        bool: True if the push should be retried.
+    """
+
+    if getattr(err, "errno", None) == errno.EMSGSIZE:
+        # An event too large for a datagram will never fit.
+        return False
+    status = getattr(getattr(err, "response", None), "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+def agent_address(agent_url):
+    """
+    Parse the URL of a local `dokumetry-agent`.
+
+    Args:
+        agent_url (str): "unix:///path/to/socket" or "udp://host:port".
+
+    Returns:
+        tuple: The socket address family and address.
+
+    Raises:
+        ValueError: If the URL is not a supported agent URL.
+    """
+
+    if agent_url.startswith("unix://"):
+        return socket.AF_UNIX, agent_url[len("unix://"):]
+    if agent_url.startswith("udp://"):
+        host, _, port = agent_url[len("udp://"):].rpartition(":")
+        if host and port.isdigit():
+            host = host.strip("[]")
+            return socket.AF_INET6 if ":" in host else socket.AF_INET, (host, int(port))
+    raise ValueError(f"Unsupported agent URL: {agent_url}")
+
+class AgentSocket:
+    """
+    Fire-and-forget datagram socket to a local `dokumetry-agent`.
+    """
+
+    def __init__(self, agent_url):
+        """
+        Initialize the socket.
+
+        Args:
+            agent_url (str): "unix:///path/to/socket" or "udp://host:port".
+        """
+
+        family, self.address = agent_address(agent_url)
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def send(self, datagram):
+        """
+        Send a datagram without waiting for the agent.
+
+        Raises:
+            OSError: If the agent is not listening or its buffer is full.
+        """
+
+        self._socket.sendto(datagram, self.address)
+
+    def close(self):
+        """
+        Close the socket.
+        """
+
+        self._socket.close()
+
+def pack_events(events, max_events, max_bytes):
+    """
+    Pack encoded events into groups for bulk push requests.
+
+    An event larger than `max_bytes` is sent in a group of its own.
+
+    Args:
+        events (list): Events encoded as JSON bytes.
+        max_events (int): Maximum number of events per group.
+        max_bytes (int): Maximum size of a JSON array body in bytes.
+
+    Returns:
+        list: Lists of encoded events.
+    """
+
+    groups = []
+    chunk, size = [], 2
+    for event in events:
+        if chunk and (len(chunk) >= max_events or size + len(event) + 1 > max_bytes):
+            groups.append(chunk)
+            chunk, size = [], 2
+        chunk.append(event)
+        size += len(event) + 1
+    if chunk:
+        groups.append(chunk)
+    return groups
+
+class AsyncExporter:
+    """
+    Exporter bound to one asyncio event loop.
+
+    Data is put on an `asyncio.Queue` and drained by a background task that
+    posts it with an `httpx.AsyncClient`, so coroutines never block the loop on
+    the Doku Ingester. Whatever is still queued when the loop shuts down is
+    handed to the thread-backed queue of the owning `Exporter`.
+    """
+
+    def __init__(self, exporter):
+        """
+        Initialize the exporter for the running event loop.
+
+        Args:
+            exporter (Exporter): Exporter whose endpoint and batching options are used.
+        """
+
+        self.exporter = exporter
+        self._httpx = import_httpx()
+        self._queue = asyncio.Queue(maxsize=exporter.max_queue_size)
+        self._pending = []
+        self._task = None
+
+    def enqueue(self, data, static_fields=None):
+        """
+        Queue data for export. Must be called from the loop this exporter is bound to.
+
+        Args:
+            data (dict): Data to be sent.
+            static_fields (StaticFields): Pre-encoded fields to add to the data.
+
+        Returns:
+            bool: False if the queue was full and the data was dropped.
+        """
+
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if static_fields is not None:
+            data = (static_fields, data)
+        try:
+            self._queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.exporter.count_dropped()
+            return False
+        return True
+
+    async def flush(self):
+        """
+        Send everything queued on this loop so far.
+        """
+
+        batch = self._take_all()
+        if batch:
+            async with self._new_client() as client:
+                await self._export(client, batch)
+
+    def hand_off(self):
+        """
+        Move queued data to the thread-backed queue of the owning exporter.
+
+        Only safe while the loop is not running or from the loop's own thread.
+        """
+
+        for data in self._take_all():
+            self.exporter.enqueue(data)
+
+    def _take_all(self):
+        batch, self._pending = self._pending, []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return batch
+
+    async def _run(self):
+        try:
+            async with self._new_client() as client:
+                try:
+                    await client.head(self.exporter.doku_url, headers=self.exporter.headers,
+                                      timeout=self.exporter.timeout)
+                except self._httpx.HTTPError as err:
+                    logging.debug("DokuMetry: Could not connect to Doku: %s", err)
+                while True:
+                    await self._fill_batch()
+                    batch, self._pending = self._pending, []
+                    await self._export(client, batch)
+        except asyncio.CancelledError:
+            self.hand_off()
+            raise
+
+    def _new_client(self):
+        limits = self._httpx.Limits(max_connections=self.exporter.pool_size,
+                                    max_keepalive_connections=self.exporter.pool_size)
+        return self._httpx.AsyncClient(http2=self.exporter.http2, limits=limits)
+
+    async def _fill_batch(self):
+        # Polls instead of using asyncio.wait_for(queue.get()), which can lose an
+        # item when the timeout races the get on older Python versions.
+        self._pending.append(await self._queue.get())
+        deadline = time.monotonic() + self.exporter.flush_interval
+        while len(self._pending) < self.exporter.batch_size:
+            try:
+                self._pending.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, 0.05))
+
+    def _prepare(self, batch):
+        """
+        Encode a batch, split it into groups and build the compressed request
+        body of each group.
+
+        Returns:
+            tuple: The groups of encoded events, and the body and headers of each.
+        """
+
+        groups = self.exporter.group(self.exporter.encode(batch))
+        return groups, [self.exporter.compress(self.exporter.body(group)) for group in groups]
+
+    async def _export(self, client, batch):
+        try:
+            # Encoding formats deferred prompts and compression takes a while
+            # for large bodies, keep both off the event loop.
+            groups, bodies = await asyncio.get_running_loop().run_in_executor(
+                None, self._prepare, batch)
+        except asyncio.CancelledError:
+            self._pending.extend(batch)
+            raise
+        failed = []
+        for index, (group, (payload, headers)) in enumerate(zip(groups, bodies)):
+            try:
+                sent = await self._try_send(client, payload, headers)
+            except asyncio.CancelledError:
+                for unsent in groups[index:]:
+                    # Encoded events are passed through when encoded again.
+                    self._pending.extend(unsent)
+                raise
+            if not sent:
+                failed.extend(group)
+        if failed:
+            # Spooling writes to disk, keep it off the event loop.
+            await asyncio.get_running_loop().run_in_executor(None, self.exporter.spool_events,
+                                                             failed)
+        else:
+            self.exporter.replay_pending()
+
+    async def _try_send(self, client, payload, headers):
+        if not self.exporter.breaker.allow():
+            return False
+        # pylint: disable=broad-exception-caught
+        try:
+            response = await client.post(self.exporter.push_url,
+                                         content=payload,
+                                         headers=headers,
+                                         timeout=self.exporter.timeout)
+            response.raise_for_status()
+        # CancelledError is an Exception before Python 3.8, keep it from the handler below.
+        except asyncio.CancelledError:  # pylint: disable=try-except-raise
+            raise
+        except self._httpx.HTTPError as http_err:
+            logging.error("DokuMetry: Error sending data to Doku: %s", http_err)
+            return self.exporter.record_result(http_err)
+        except Exception as err:
+            logging.error("DokuMetry: Error exporting data to Doku: %s", err)
+        self.exporter.breaker.record_success()
+        return True
+
+_exporters = {}
+_exporters_lock = threading.Lock()
+
+def get_exporter(doku_url, api_key):
+    """
+    Return the exporter for a Doku URL and api_key, creating it if needed.
+
+    Args:
+        doku_url (str): Doku URL.
+        api_key (str): Doku Authentication api_key.
+
+    Returns:
+        Exporter: The shared exporter for this Doku endpoint.
+    """
+
+    exporter = _exporters.get((doku_url, api_key))
+    if exporter is None:
+        with _exporters_lock:
+            exporter = _exporters.get((doku_url, api_key))
+            if exporter is None:
+                exporter = Exporter(doku_url, api_key)
+                _exporters[(doku_url, api_key)] = exporter
+    return exporter
+
+def configure_exporter(doku_url, api_key, **options):
+    """
+    Create or replace the exporter for a Doku URL and api_key.
+
+    An existing exporter created with different options is flushed and replaced.
+
+    Args:
+        doku_url (str): Doku URL.
+        api_key (str): Doku Authentication api_key.
+        **options: Keyword arguments accepted by `Exporter`.
+
+    Returns:
+        Exporter: The shared exporter for this Doku endpoint.
+    """
+
+    with _exporters_lock:
+        previous = _exporters.get((doku_url, api_key))
+        if previous is not None and dict(previous.options, **options) == previous.options:
+            return previous
+        exporter = Exporter(doku_url, api_key, **options)
+        _exporters[(doku_url, api_key)] = exporter
+    if previous is not None:
+        previous.shutdown(timeout=5)
+    return exporter
+
+def flush(timeout=None):
+    """
+    Flush every exporter.
+
+    Args:
+        timeout (float): Seconds to wait for each exporter, None to wait forever.
+
+    Returns:
+        bool: True if every exporter flushed within the timeout.
+    """
+
+    flushed = True
+    for exporter in list(_exporters.values()):
+        flushed = exporter.flush(timeout) and flushed
+    return flushed
+
+def stats():
+    """
+    Return export statistics of every exporter.
+
+    Returns:
+        dict: `Exporter.stats()` of each exporter, keyed by Doku URL.
+    """
+
+    return {exporter.doku_url: exporter.stats() for exporter in list(_exporters.values())}
+
+def _shutdown_all():
+    for exporter in list(_exporters.values()):
+        exporter.shutdown(timeout=5)
+
+def _after_fork_in_child():
+    # pylint: disable=global-statement
+    global _exporters_lock
+    _exporters_lock = threading.Lock()
+    for exporter in _exporters.values():
+        exporter.after_fork_in_child()
+
+atexit.register(_shutdown_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
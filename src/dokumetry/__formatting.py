@@ -0,0 +1,119 @@
+"""
+This module has the formatting of chat messages and embedding inputs into the
+prompt sent to Doku.
+"""
+
+from .__media import describe_data_uri, describe_inline
+
+# Longer contents are copied into the prompt once instead of twice.
+LONG_CONTENT_CHARS = 1024
+
+# Embedding input previews are cut to this many characters.
+PREVIEW_CHARS = 200
+
+def _format_source(source):
+    if source.get('type') == 'base64':
+        return describe_inline(source['data'], source.get('media_type'))
+    return source.get('url', source.get('type'))
+
+def _format_item(item):
+    if 'text' in item:
+        return f"{item.get('type', 'text')}: {item['text']}"
+    kind = item['type']
+    if 'image_url' in item:
+        value = item['image_url']
+        if isinstance(value, dict):
+            value = value.get('url')
+    elif 'source' in item:
+        value = _format_source(item['source'])
+    else:
+        value = item.get(kind)
+    if isinstance(value, str) and value.startswith("data:"):
+        value = describe_data_uri(value)
+    return f"{kind}: {value}"
+
+def format_messages(messages, separator="\n"):
+    """
+    Format chat messages as the prompt sent to Doku.
+
+    Args:
+        messages (list): Messages of the request, as dicts or as objects with
+            `role` and `content` attributes.
+        separator (str): Joins the formatted messages.
+
+    Returns:
+        str: One "role: content" entry per message.
+    """
+
+    entries = []
+    append = entries.append
+    # Role of each long content, by index in `entries`.
+    long_roles = None
+    for message in messages:
+        # Subscripting first keeps dict messages, the common case, fast.
+        try:
+            role = message["role"]
+        except TypeError:
+            role = message.role
+            content = getattr(message, "content", None)
+        else:
+            try:
+                content = message["content"]
+            except KeyError: # Assistant messages with tool calls
+                content = None
+        if isinstance(content, str):
+            if len(content) >= LONG_CONTENT_CHARS:
+                if long_roles is None:
+                    long_roles = {}
+                long_roles[len(entries)] = role
+                append(content)
+                continue
+        elif isinstance(content, list):
+            content = ', '.join([_format_item(item) for item in content])
+        append(f"{role}: {content}")
+    if long_roles is None:
+        return separator.join(entries)
+    parts = []
+    for index, entry in enumerate(entries):
+        if index:
+            parts.append(separator)
+        if index in long_roles:
+            parts.append(f"{long_roles[index]}: ")
+        parts.append(entry)
+    return "".join(parts)
+
+def describe_inputs(inputs, separator=", ", previews=3):
+    """
+    Describe the inputs of an embeddings request for the data sent to Doku.
+
+    The inputs are counted rather than joined, so the cost does not grow with
+    the text of the batch. Up to `previews` inputs, spread over the batch, are
+    cut to `PREVIEW_CHARS` characters and joined as the prompt.
+
+    Args:
+        inputs: A text, a list of texts, a list of token ids, or a list of
+            lists of token ids.
+        separator (str): Joins the previews.
+        previews (int): Number of inputs previewed in the prompt, 0 for none.
+
+    Returns:
+        dict: The prompt and the number of inputs, with the total characters
+        of the texts and the total tokens of the token ids.
+    """
+
+    if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    texts = [item for item in inputs if isinstance(item, str)]
+    count = len(inputs)
+    fields = {"inputCount": count}
+    if texts:
+        fields["inputChars"] = sum(map(len, texts))
+    if len(texts) < count:
+        fields["inputTokens"] = sum(len(item) for item in inputs if not isinstance(item, str))
+    if texts and previews > 0:
+        step = max(len(texts) / previews, 1)
+        sampled = [texts[int(i * step)] for i in range(min(previews, len(texts)))]
+        fields["prompt"] = separator.join(text[:PREVIEW_CHARS] for text in sampled)
+    else:
+        fields["prompt"] = ""
+    return fields
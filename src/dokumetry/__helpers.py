@@ -2,32 +2,45 @@
 This moduel has send_data functions to be used by other modules.
 """
 
-import logging
-import requests
+from .__exporter import get_exporter
 
-def send_data(data, doku_url, doku_token):
+def _drop_response(data, static_fields):
+    if static_fields is not None and not static_fields.capture_response:
+        data.pop("response", None)
+        for choice in data.get("choices", ()):
+            choice.pop("response", None)
+
+def send_data(data, doku_url, doku_token, static_fields=None):
     """
-    Send data to the specified Doku URL.
+    Queue data to be sent to the specified Doku URL.
+
+    The data is handed to the background exporter for this Doku URL, so the
+    call returns without waiting on the network. The response is left out when
+    the caller does not capture responses.
 
     Args:
         data (dict): Data to be sent.
-        api_url (str): URL of the API endpoint.
-        auth_token (str): Authentication api_key.
+        doku_url (str): URL of the API endpoint.
+        doku_token (str): Authentication api_key.
+        static_fields (StaticFields): Fields shared by the caller's events.
+    """
 
-    Raises:
-        requests.exceptions.RequestException: If an error occurs during the request.
+    _drop_response(data, static_fields)
+    get_exporter(doku_url, doku_token).enqueue(data, static_fields)
+
+async def send_data_async(data, doku_url, doku_token, static_fields=None):
+    """
+    Queue data to be sent to the specified Doku URL from a coroutine.
+
+    The data is handed to the exporter of the running event loop, which sends
+    it from a background task without blocking the loop.
+
+    Args:
+        data (dict): Data to be sent.
+        doku_url (str): URL of the API endpoint.
+        doku_token (str): Authentication api_key.
+        static_fields (StaticFields): Fields shared by the caller's events.
     """
 
-    try:
-        headers = {
-            'Authorization': doku_token,
-            'Content-Type': 'application/json',
-        }
-
-        response = requests.post(doku_url.rstrip("/") + "/api/push",
-                                 json=data,
-                                 headers=headers,
-                                 timeout=30)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as req_err:
-        logging.error("DokuMetry: Error sending data to Doku: %s", req_err)
+    _drop_response(data, static_fields)
+    get_exporter(doku_url, doku_token).enqueue_async(data, static_fields)
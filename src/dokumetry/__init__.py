@@ -1,20 +1,9 @@
 """
 __init__ module for dokumetry package.
 """
-from anthropic import AsyncAnthropic, Anthropic
-from openai import AsyncOpenAI, OpenAI, AzureOpenAI, AsyncAzureOpenAI
-from mistralai.async_client import MistralAsyncClient
-from mistralai.client import MistralClient
-
-from .openai import init as init_openai
-from .async_openai import init as init_async_openai
-from .azure_openai import init as init_azure_openai
-from .async_azure_openai import init as init_async_azure_openai
-from .anthropic import init as init_anthropic
-from .async_anthropic import init as init_async_anthropic
-from .cohere import init as init_cohere
-from .mistral import init as init_mistral
-from .async_mistral import init as init_async_mistral
+from .__exporter import configure_exporter, flush as flush_exporters, stats as exporter_stats
+from .__registry import instrument, register as register_instrumentation
+from .__registry import uninstrument as uninstrument_client
 
 # pylint: disable=too-few-public-methods
 class DokuConfig:
@@ -28,9 +17,29 @@ class DokuConfig:
     environment = None
     application_name = None
     skip_resp = None
+    capture_response = None
+    capture_images = None
+    embedding_previews = None
+    instrument_classes = None
+    batch_size = None
+    flush_interval = None
+    max_queue_size = None
+    pool_size = None
+    http2 = None
+    bulk_push = None
+    max_batch_bytes = None
+    compression = None
+    compression_threshold = None
+    spool_dir = None
+    timeout = None
+    agent_url = None
 
-# pylint: disable=too-many-arguments, line-too-long, too-many-return-statements
-def init(llm, doku_url, api_key, environment="default", application_name="default", skip_resp=False):
+# pylint: disable=too-many-arguments, line-too-long
+def init(llm, doku_url, api_key, environment="default", application_name="default", skip_resp=False,
+         batch_size=100, flush_interval=1.0, max_queue_size=10000, pool_size=10, http2=False,
+         bulk_push=False, max_batch_bytes=1000000, compression=None, compression_threshold=1024,
+         spool_dir=None, timeout=10.0, agent_url=None, capture_response=True,
+         capture_images=False, embedding_previews=3, instrument_classes=False):
     """
     Initialize Doku configuration based on the provided function.
 
@@ -41,6 +50,29 @@ def init(llm, doku_url, api_key, environment="default", application_name="defaul
         environment (str): Doku environment.
         application_name (str): Doku application name.
         skip_resp (bool): Skip response processing.
+        batch_size (int): Maximum number of events the background exporter flushes together.
+        flush_interval (float): Maximum seconds an event waits in the exporter before a flush.
+        max_queue_size (int): Events buffered by the exporter before new ones are dropped.
+        pool_size (int): Keep-alive connections the exporter keeps open to Doku.
+        http2 (bool): Multiplex exporter requests over HTTP/2 (needs `httpx[http2]`).
+        bulk_push (bool): Send each batch to Doku as one JSON array request.
+        max_batch_bytes (int): Maximum body size of a bulk push request.
+        compression (str): Compress requests to Doku with "gzip" or "zstd" (needs `zstandard`).
+        compression_threshold (int): Requests smaller than this many bytes are not compressed.
+        spool_dir (str): Directory where data Doku could not accept is kept and replayed from.
+        timeout (float): Seconds the exporter waits for Doku to answer a request.
+        agent_url (str): Send data to a local `dokumetry-agent` at "unix:///path/to/socket"
+            or "udp://127.0.0.1:port" instead of `doku_url`.
+        capture_response (bool): Send LLM responses to Doku. When False, responses are never
+            buffered or sent, streamed responses are reported as a number of chunks and bytes.
+        capture_images (bool): Send images generated as base64 to Doku, not only their sizes
+            and hashes.
+        embedding_previews (int): Number of inputs of an embeddings request, spread over the
+            batch and cut to 200 characters, sent as its prompt. Inputs are otherwise only
+            counted. 0 sends no previews.
+        instrument_classes (bool): Instrument the classes of the SDK of `llm` instead of `llm`
+            alone, so every client of these classes is tracked without calling `init` for it.
+            Calling `init` for a client with other settings applies them to that client.
     """
 
     DokuConfig.llm = llm
@@ -49,33 +81,74 @@ def init(llm, doku_url, api_key, environment="default", application_name="defaul
     DokuConfig.environment = environment
     DokuConfig.application_name = application_name
     DokuConfig.skip_resp = skip_resp
+    DokuConfig.batch_size = batch_size
+    DokuConfig.flush_interval = flush_interval
+    DokuConfig.max_queue_size = max_queue_size
+    DokuConfig.pool_size = pool_size
+    DokuConfig.http2 = http2
+    DokuConfig.bulk_push = bulk_push
+    DokuConfig.max_batch_bytes = max_batch_bytes
+    DokuConfig.compression = compression
+    DokuConfig.compression_threshold = compression_threshold
+    DokuConfig.spool_dir = spool_dir
+    DokuConfig.timeout = timeout
+    DokuConfig.agent_url = agent_url
+    DokuConfig.capture_response = capture_response
+    DokuConfig.capture_images = capture_images
+    DokuConfig.embedding_previews = embedding_previews
+    DokuConfig.instrument_classes = instrument_classes
 
-    # pylint: disable=no-else-return, line-too-long
-    if hasattr(llm, 'moderations') and callable(llm.chat.completions.create) and ('.openai.azure.com/' not in str(llm.base_url)):
-        if isinstance(llm, OpenAI):
-            init_openai(llm, doku_url, api_key, environment, application_name, skip_resp)
-        elif isinstance(llm, AsyncOpenAI):
-            init_async_openai(llm, doku_url, api_key, environment, application_name, skip_resp)
-        return
-    # pylint: disable=no-else-return, line-too-long
-    if hasattr(llm, 'moderations') and callable(llm.chat.completions.create) and ('.openai.azure.com/' in str(llm.base_url)):
-        if isinstance(llm, AzureOpenAI):
-            init_azure_openai(llm, doku_url, api_key, environment, application_name, skip_resp)
-        elif isinstance(llm, AsyncAzureOpenAI):
-            init_async_azure_openai(llm, doku_url, api_key, environment, application_name, skip_resp)
-        return
-    if isinstance(llm, MistralClient):
-        init_mistral(llm, doku_url, api_key, environment, application_name, skip_resp)
-        return
-    elif isinstance(llm, MistralAsyncClient):
-        init_async_mistral(llm, doku_url, api_key, environment, application_name, skip_resp)
-        return
-    elif isinstance(llm, AsyncAnthropic):
-        init_async_anthropic(llm, doku_url, api_key, environment, application_name, skip_resp)
-        return
-    elif isinstance(llm, Anthropic):
-        init_anthropic(llm, doku_url, api_key, environment, application_name, skip_resp)
-        return
-    elif hasattr(llm, 'generate') and callable(llm.generate):
-        init_cohere(llm, doku_url, api_key, environment, application_name, skip_resp)
-        return
+    configure_exporter(doku_url, api_key, batch_size=batch_size,
+                       flush_interval=flush_interval, max_queue_size=max_queue_size,
+                       pool_size=pool_size, http2=http2, bulk_push=bulk_push,
+                       max_batch_bytes=max_batch_bytes, compression=compression,
+                       compression_threshold=compression_threshold,
+                       spool_dir=spool_dir, timeout=timeout, agent_url=agent_url).start()
+
+    instrument(llm, doku_url, api_key, environment, application_name, skip_resp,
+               capture_response=capture_response, capture_images=capture_images,
+               embedding_previews=embedding_previews, classes=instrument_classes)
+
+def flush(timeout=None):
+    """
+    Send all data queued by the background exporters to Doku.
+
+    Useful before a short-lived process exits, e.g. at the end of a serverless invocation.
+
+    Args:
+        timeout (float): Seconds to wait for each exporter, None to wait forever.
+
+    Returns:
+        bool: True if all queued data was handed to Doku within the timeout.
+    """
+
+    return flush_exporters(timeout)
+
+def stats():
+    """
+    Return statistics of the background exporters.
+
+    Returns:
+        dict: For each Doku URL, the events dropped on a full queue, the bytes sent
+        before and after compression, and the compression ratio achieved.
+    """
+
+    return exporter_stats()
+
+def uninstrument(llm):
+    """
+    Stop tracking an LLM client, restoring the methods `init` patched.
+
+    The client then runs exactly as if `init` had never been called for it. If
+    it was initialized with `instrument_classes`, the classes of its SDK are
+    restored for its class, which stops tracking every client of that class.
+    Clients of other classes initialized with `instrument_classes` stay tracked.
+
+    Args:
+        llm: The client passed to `init`.
+
+    Returns:
+        bool: True if the client was tracked.
+    """
+
+    return uninstrument_client(llm)
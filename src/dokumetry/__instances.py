@@ -0,0 +1,73 @@
+"""
+This module has the instrumentation of a single LLM client, which records the
+patches made to the client and its resources so they can be undone.
+"""
+
+# Attribute of a client listing the patches made to it and its resources.
+PATCHES_ATTRIBUTE = "_dokumetry_patched"
+
+# Stands for an attribute the object did not have before it was patched.
+_MISSING = object()
+
+class _Recorder:
+    """
+    Stands in for a client, or one of its resources, while an instrumentation
+    patches it, remembering what each patched attribute was before.
+    """
+
+    def __init__(self, target, patched):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_patched", patched)
+
+    @property
+    def __class__(self):
+        return type(self._target)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value) or not hasattr(value, "__dict__"):
+            return value
+        return _Recorder(value, self._patched)
+
+    def __setattr__(self, name, value):
+        self._patched.append((self._target, name, vars(self._target).get(name, _MISSING)))
+        setattr(self._target, name, value)
+
+def instrument_instance(llm, init_function, args, options):
+    """
+    Patch an LLM client, replacing the patches of an earlier call if any.
+
+    Args:
+        llm: The LLM client.
+        init_function (function): The instrumentation of the client's class.
+        args (tuple): Positional arguments of `init_function` after the client.
+        options (dict): Keyword arguments of `init_function`.
+    """
+
+    uninstrument_instance(llm)
+    patched = []
+    try:
+        init_function(_Recorder(llm, patched), *args, **options)
+    finally:
+        setattr(llm, PATCHES_ATTRIBUTE, patched)
+
+def uninstrument_instance(llm):
+    """
+    Restore the attributes of an LLM client patched by `instrument_instance`.
+
+    Args:
+        llm: The LLM client.
+
+    Returns:
+        bool: True if the client was instrumented.
+    """
+
+    patched = vars(llm).pop(PATCHES_ATTRIBUTE, None)
+    if patched is None:
+        return False
+    for target, name, previous in reversed(patched):
+        if previous is _MISSING:
+            vars(target).pop(name, None)
+        else:
+            setattr(target, name, previous)
+    return True
@@ -0,0 +1,188 @@
+"""
+This module describes images and other media sent to or returned by LLMs.
+"""
+
+import hashlib
+
+# Inline content is hashed from samples of this many characters at its start,
+# middle and end.
+SAMPLE_CHARS = 4096
+
+def content_hash(data):
+    """
+    Return a short hash identifying some content.
+
+    Args:
+        data (bytes): The content.
+
+    Returns:
+        str: 16 hexadecimal digits of the BLAKE2b digest.
+    """
+
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def base64_size(encoded, start=0):
+    """
+    Return the size of base64 encoded data once decoded, without decoding it.
+
+    Args:
+        encoded (str): The base64 text.
+        start (int): Index at which the base64 data starts in `encoded`.
+
+    Returns:
+        int: The decoded size in bytes.
+    """
+
+    return (len(encoded) - start) * 3 // 4 - encoded[-2:].count("=")
+
+def sampled_hash(text, start=0):
+    """
+    Return a hash identifying some inline content in constant time.
+
+    Content longer than three samples is hashed from its length and from
+    samples at its start, middle and end, without copying the rest.
+
+    Args:
+        text (str): The content.
+        start (int): Index at which the content starts in `text`.
+
+    Returns:
+        str: 16 hexadecimal digits of the BLAKE2b digest.
+    """
+
+    length = len(text) - start
+    if length <= 3 * SAMPLE_CHARS:
+        sample = text[start:]
+    else:
+        middle = start + length // 2
+        sample = (f"{length}:{text[start:start + SAMPLE_CHARS]}"
+                  f"{text[middle:middle + SAMPLE_CHARS]}{text[-SAMPLE_CHARS:]}")
+    return content_hash(sample.encode("utf-8", "replace"))
+
+def describe_inline(text, mime_type, start=0, is_base64=True):
+    """
+    Describe inline content sent to an LLM, such as an image, for the prompt.
+
+    Args:
+        text (str): The content, base64 encoded when `is_base64`.
+        mime_type (str): The type of the content.
+        start (int): Index at which the content starts in `text`.
+        is_base64 (bool): Whether the content is base64 encoded.
+
+    Returns:
+        str: The type, decoded size and sampled hash of the content.
+    """
+
+    size = base64_size(text, start) if is_base64 else len(text) - start
+    return f"[{mime_type}, {size} bytes, {sampled_hash(text, start)}]"
+
+def describe_data_uri(uri):
+    """
+    Describe a `data:` URI for the prompt, without copying or decoding its data.
+
+    Args:
+        uri (str): The URI, starting with "data:".
+
+    Returns:
+        str: The type, decoded size and sampled hash of the data.
+    """
+
+    comma = uri.find(",", 0, 256)
+    header = uri[5:comma] if comma >= 0 else ""
+    is_base64 = header.endswith(";base64")
+    mime_type = header[:-7] if is_base64 else header
+    return describe_inline(uri, mime_type.split(";")[0] or "text/plain", comma + 1, is_base64)
+
+def describe_images(images, image_format, capture_images=False):
+    """
+    Describe the images of an images API response for the data sent to Doku.
+
+    Generated URLs are sent as they are. Base64 images are described by their
+    size and sampled hash, the images themselves are only sent if
+    `capture_images`. Only the sizes and hashes are queued for export, so the
+    images are not kept alive until the event is sent.
+
+    Args:
+        images (list): The `data` items of the response.
+        image_format (str): "url" or "b64_json", the response format requested.
+        capture_images (bool): Send base64 images to Doku.
+
+    Returns:
+        dict: The number of images, and either their URLs, or the sizes and
+        hashes of base64 images, with the images themselves when captured. A
+        single image is sent as "image", several as "images".
+    """
+
+    fields = {"imageCount": len(images)}
+    if image_format == "b64_json":
+        encoded = [item.b64_json or "" for item in images]
+        fields["imageBytes"] = [base64_size(image) for image in encoded]
+        fields["imageHashes"] = [sampled_hash(image) for image in encoded]
+        if not capture_images:
+            return fields
+    else:
+        encoded = [item.url for item in images]
+    if len(encoded) == 1:
+        fields["image"] = encoded[0]
+    elif encoded:
+        fields["images"] = encoded
+    return fields
+
+def http_response_of(response):
+    """
+    Return the HTTP response behind an SDK response.
+
+    Args:
+        response: The response, holding the HTTP response in `http_response`,
+            or `response` for buffered binary responses.
+
+    Returns:
+        The HTTP response, None when there is none.
+    """
+
+    http_response = getattr(response, "http_response", None)
+    if http_response is None:
+        http_response = getattr(response, "response", None)
+    return http_response
+
+def is_streamed(response):
+    """
+    Tell whether the body of a response is left for the caller to stream.
+
+    Args:
+        response: The response returned by the provider's client.
+
+    Returns:
+        bool: True when the HTTP response is still open.
+    """
+
+    http_response = http_response_of(response)
+    return http_response is not None and not getattr(http_response, "is_closed", True)
+
+def describe_audio(response, duration, size=None):
+    """
+    Describe the audio of a speech API response for the data sent to Doku.
+
+    Unless given, the size is that of the body the client has already read, so
+    the audio is not copied. Streamed bodies are counted as the caller reads
+    them, see `TracedAudioStream`.
+
+    Args:
+        response: The response returned by the provider's client.
+        duration (float): Duration of the request, in seconds.
+        size (int): Bytes of audio read by the caller, if it streamed them.
+
+    Returns:
+        dict: The size of the audio and the bytes received per second, or
+        nothing when the body has not been read.
+    """
+
+    if size is None:
+        http_response = http_response_of(response)
+        if http_response is None or not getattr(http_response, "is_closed", False):
+            return {}
+        try:
+            size = len(http_response.content)
+        except RuntimeError: # Closed without being read
+            return {}
+    return {"audioBytes": size, "audioBytesPerSecond": size / duration if duration > 0 else None}
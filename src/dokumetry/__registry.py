@@ -0,0 +1,184 @@
+"""
+This module has the registry that maps LLM client classes to the
+instrumentation that patches them.
+"""
+
+import importlib
+import inspect
+import logging
+from .__classes import (forget_resolved, instrument_classes, is_instrumented,
+                        uninstrument_classes)
+from .__instances import instrument_instance, uninstrument_instance
+
+# Entry point group of instrumentations provided by other packages. The name of
+# an entry point is the client class it instruments, as in `INSTRUMENTATIONS`,
+# and its value the instrumentation's `init` function, e.g.
+# "acme.AcmeClient = dokumetry_acme:init".
+ENTRY_POINT_GROUP = "dokumetry.instrumentations"
+
+# Instrumentation module of each client class, by "package.ClassName".
+INSTRUMENTATIONS = {
+    "openai.OpenAI": "openai",
+    "openai.AsyncOpenAI": "async_openai",
+    "openai.AzureOpenAI": "azure_openai",
+    "openai.AsyncAzureOpenAI": "async_azure_openai",
+    "anthropic.Anthropic": "anthropic",
+    "anthropic.AsyncAnthropic": "async_anthropic",
+    "mistralai.MistralClient": "mistral",
+    "mistralai.MistralAsyncClient": "async_mistral",
+    "cohere.Client": "cohere",
+}
+
+_registry = dict(INSTRUMENTATIONS)
+_entry_points_loaded = False # pylint: disable=invalid-name
+# Instrumentation found for each client class, None when there is none.
+_by_class = {}
+
+def class_name(cls):
+    """
+    Return the name a class is registered under.
+
+    Args:
+        cls (type): The class.
+
+    Returns:
+        str: "package.ClassName", such as "openai.OpenAI".
+    """
+
+    return f"{cls.__module__.partition('.')[0]}.{cls.__name__}"
+
+def register(name, init_function):
+    """
+    Register the instrumentation of a client class, replacing any other.
+
+    Args:
+        name (str): The class, as "package.ClassName".
+        init_function (function): Patches a client, called like the `init`
+            functions of the instrumentation modules of this package.
+    """
+
+    _registry[name] = init_function
+    _by_class.clear()
+    forget_resolved()
+
+def registered_class(cls):
+    """
+    Return the class whose registered instrumentation applies to a client class.
+
+    Args:
+        cls (type): The client class.
+
+    Returns:
+        type: The first class of `cls.__mro__` an instrumentation is registered
+        for, None if there is none.
+    """
+
+    if not _entry_points_loaded:
+        _load_entry_points()
+    for base in cls.__mro__:
+        if class_name(base) in _registry:
+            return base
+    return None
+
+def _load_entry_points():
+    # pylint: disable=global-statement
+    global _entry_points_loaded
+    _entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points # pylint: disable=import-outside-toplevel
+    except ImportError: # Python 3.7
+        return
+    try:
+        found = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError: # Python 3.8 and 3.9
+        found = entry_points().get(ENTRY_POINT_GROUP, [])
+    for entry_point in found:
+        _registry[entry_point.name] = entry_point
+
+def _resolve(name):
+    target = _registry[name]
+    if isinstance(target, str):
+        return importlib.import_module(f".{target}", __package__).init
+    if hasattr(target, "load"):
+        try:
+            target = target.load()
+        except Exception as err: # pylint: disable=broad-exception-caught
+            logging.warning("DokuMetry: Could not load the instrumentation of %s: %s", name, err)
+            return None
+        _registry[name] = target
+    return target
+
+def _options(init_function):
+    parameters = inspect.signature(init_function).parameters.values()
+    if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters):
+        return None
+    return frozenset(parameter.name for parameter in parameters)
+
+def _find(llm):
+    if not _entry_points_loaded:
+        _load_entry_points()
+    for cls in type(llm).__mro__:
+        name = class_name(cls)
+        if name in _registry:
+            init_function = _resolve(name)
+            if init_function is not None:
+                return init_function, _options(init_function)
+    if hasattr(llm, 'generate') and callable(llm.generate):
+        # Cohere clients of versions not registered above.
+        init_function = _resolve("cohere.Client")
+        return init_function, _options(init_function)
+    return None
+
+def instrument(llm, *args, classes=False, **options):
+    """
+    Patch an LLM client with the instrumentation registered for its class.
+
+    The instrumentation is looked up on the class of the client and then its
+    base classes, the first one registered wins. The result is kept for each
+    class, so later clients of the same class are matched with one lookup.
+
+    Instrumenting a client again replaces its earlier patches. Clients whose
+    classes are instrumented always get their settings through the classes,
+    so no call is tracked twice.
+
+    Args:
+        llm: The LLM client.
+        *args: Passed on to the instrumentation's `init`.
+        classes (bool): Patch the classes of the client and its resources
+            rather than the client, see `instrument_classes`.
+        **options: Passed on to the instrumentation's `init` when it takes them.
+
+    Returns:
+        bool: True if the client was instrumented.
+    """
+
+    cls = type(llm)
+    try:
+        found = _by_class[cls]
+    except KeyError:
+        found = _by_class[cls] = _find(llm)
+    if found is None:
+        return False
+    init_function, accepted = found
+    if accepted is not None:
+        options = {key: value for key, value in options.items() if key in accepted}
+    if classes or is_instrumented(llm):
+        uninstrument_instance(llm)
+        instrument_classes(llm, init_function, args, options)
+    else:
+        instrument_instance(llm, init_function, args, options)
+    return True
+
+def uninstrument(llm):
+    """
+    Undo the instrumentation of an LLM client.
+
+    Args:
+        llm: The LLM client.
+
+    Returns:
+        bool: True if the client, or its classes, were instrumented.
+    """
+
+    restored = uninstrument_instance(llm)
+    return uninstrument_classes(llm) or restored
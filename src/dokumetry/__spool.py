@@ -0,0 +1,264 @@
+"""
+This module has the disk spool that keeps data Doku could not accept.
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+def _lock(path):
+    # Open a segment and lock it, None if a live process holds its lock. The lock
+    # goes away with the process that holds it, even when a process started
+    # later gets the same PID, as in a restarted container.
+    try:
+        segment = open(path, "rb") # pylint: disable=consider-using-with
+    except OSError:
+        return None
+    try:
+        fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        segment.close()
+        return None
+    return segment
+
+# pylint: disable=too-many-instance-attributes
+class Spool:
+    """
+    Append-only spool of encoded events, split into segment files.
+
+    Each process appends one event per line to its own `.open` segment, which
+    becomes a closed `.spool` segment once it reaches `segment_bytes`. Writes are
+    flushed to the OS right away and fsynced at most every `fsync_interval`
+    seconds. A replayer claims a closed segment by renaming it, so segments are
+    replayed once even when several processes share the directory. Open and
+    claimed segments are locked with `flock` by the process using them, so
+    segments left behind by processes that died are picked up again, and a partly
+    written last line is skipped. Without `flock`, e.g. on Windows, they are not.
+    """
+
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, max_bytes=512 * 1024 * 1024,
+                 fsync_interval=1.0):
+        """
+        Initialize the spool.
+
+        Args:
+            directory (str): Directory holding the segment files, created if needed.
+            segment_bytes (int): Size at which a segment is closed for replay.
+            max_bytes (int): Size of all segments above which events are dropped.
+            fsync_interval (float): Maximum seconds between fsyncs of the open segment.
+        """
+
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._last_fsync = 0.0
+        self._sequence = 0
+        # Lock of each segment claimed by this process, by path.
+        self._claims = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, events):
+        """
+        Append encoded events to the open segment.
+
+        Args:
+            events (list): Events encoded as single-line JSON bytes.
+
+        Returns:
+            bool: False if the spool is full and the events were dropped.
+
+        Raises:
+            OSError: If the segment could not be written, e.g. the disk is full.
+        """
+
+        if not events:
+            return True
+        with self._lock:
+            if self.size() >= self.max_bytes:
+                self.dropped += len(events)
+                logging.warning("DokuMetry: Spool %s is full, %d events dropped so far",
+                                self.directory, self.dropped)
+                return False
+            if self._file is None:
+                self._open()
+            try:
+                self._file.write(b"".join(event + b"\n" for event in events))
+                self._file.flush()
+                now = time.monotonic()
+                if now - self._last_fsync >= self.fsync_interval:
+                    os.fsync(self._file.fileno())
+                    self._last_fsync = now
+                if self._file.tell() >= self.segment_bytes:
+                    self._close()
+            except OSError:
+                self._abandon()
+                raise
+        return True
+
+    def claim(self):
+        """
+        Claim the oldest closed segment for replay.
+
+        Returns:
+            str: Path of the claimed segment, None if there is nothing to replay.
+        """
+
+        with self._lock:
+            if self._file is not None and self._file.tell() > 0:
+                # Replay what this process spooled so far as well.
+                self._close()
+        self._recover()
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.spool"))):
+            claimed = f"{path}.replay-{os.getpid()}"
+            lock = None
+            if fcntl is not None:
+                lock = _lock(path)
+                if lock is None:
+                    continue
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                if lock is not None:
+                    lock.close()
+                continue
+            self._claims[claimed] = lock
+            return claimed
+        return None
+
+    @staticmethod
+    def read(path):
+        """
+        Read the events of a claimed segment.
+
+        Args:
+            path (str): Path returned by `claim`.
+
+        Returns:
+            list: Encoded events, without a partly written last line.
+        """
+
+        with open(path, "rb") as segment:
+            lines = segment.read().split(b"\n")
+        # The last item is empty after a complete line, or a partial write.
+        return [line for line in lines[:-1] if line]
+
+    def release(self, path):
+        """
+        Delete a claimed segment once its events have been handled.
+
+        Args:
+            path (str): Path returned by `claim`.
+        """
+
+        lock = self._claims.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError as err:
+            logging.error("DokuMetry: Could not remove spool segment %s: %s", path, err)
+        if lock is not None:
+            lock.close()
+
+    def size(self):
+        """
+        Return the total size of all segments in bytes.
+        """
+
+        total = 0
+        for path in glob.glob(os.path.join(self.directory, "*.spool*")):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def close(self):
+        """
+        Close the open segment so it can be replayed.
+        """
+
+        with self._lock:
+            if self._file is not None:
+                self._close()
+
+    def after_fork_in_child(self):
+        """
+        Forget the parent's open and claimed segments in a forked child.
+
+        The child opens a segment of its own on its next `append`. Its copies of
+        the parent's files are closed, so the segments can be recovered once the
+        parent dies.
+        """
+
+        self._lock = threading.Lock()
+        for inherited in [self._file, *self._claims.values()]:
+            if inherited is not None:
+                inherited.close()
+        self._claims = {}
+        self._file = None
+        self._path = None
+
+    def _open(self):
+        # The directory may have been removed since.
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self._sequence}"
+        new_path = os.path.join(self.directory, f"{name}.new")
+        # Unbuffered, so a forked child has no copy of pending writes to flush again.
+        # pylint: disable=consider-using-with
+        self._file = open(new_path, "ab", buffering=0)
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        # Named as an open segment only once locked, so it is never recovered early.
+        self._path = os.path.join(self.directory, f"{name}.spool.open")
+        os.rename(new_path, self._path)
+
+    def _close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # Renamed before the lock goes away with the file.
+        os.rename(self._path, self._path[:-len(".open")])
+        self._file.close()
+        self._file = None
+        self._path = None
+
+    def _abandon(self):
+        # Close a segment that failed to be written, keeping what was written of
+        # it for replay. A partly written last line is skipped by `read`, later
+        # events go to a new segment.
+        try:
+            os.rename(self._path, self._path[:-len(".open")])
+        except OSError:
+            pass
+        self._file.close()
+        self._file = None
+        self._path = None
+
+    def _recover(self):
+        # Hand segments of processes that died back to the replayers.
+        if fcntl is None:
+            return
+        for path in glob.glob(os.path.join(self.directory, "*.spool.*")):
+            base, _, suffix = path.rpartition(".spool.")
+            if suffix != "open" and not suffix.startswith("replay-"):
+                continue
+            lock = _lock(path)
+            if lock is None:
+                continue
+            try:
+                os.rename(path, base + ".spool")
+            except OSError:
+                pass
+            lock.close()
@@ -0,0 +1,390 @@
+"""
+This module has the accumulator that collects streamed responses.
+"""
+
+import time
+
+# pylint: disable=too-many-instance-attributes
+class StreamAccumulator:
+    """
+    Collects the text of a streamed response.
+
+    Chunks are kept in a list and joined once when the stream ends, so the cost
+    grows linearly with the length of the response instead of copying the text
+    built so far for every chunk. When responses are not captured only the
+    number of chunks and their size in bytes are kept.
+
+    The arrival of each chunk is timed with a monotonic clock from the moment
+    the accumulator is created, right before the request is made.
+    """
+
+    def __init__(self, capture_response=True, count_words=False):
+        """
+        Initialize an empty accumulator.
+
+        Args:
+            capture_response (bool): Keep the text, otherwise count chunks and bytes.
+            count_words (bool): Count words as they arrive when the text is not kept.
+        """
+
+        self.capture_response = capture_response
+        self.count_words = count_words and not capture_response
+        self.parts = []
+        self.chunks = 0
+        self.size = 0
+        self._words = 0
+        self._in_word = False
+        self.started = time.perf_counter()
+        self.first_chunk_at = None
+        self.last_chunk_at = None
+        self.max_gap = 0.0
+
+    def tick(self):
+        """
+        Record the arrival of a chunk with content.
+        """
+
+        now = time.perf_counter()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        elif now - self.last_chunk_at > self.max_gap:
+            self.max_gap = now - self.last_chunk_at
+        self.last_chunk_at = now
+        self.chunks += 1
+
+    def add(self, text):
+        """
+        Add the text of a chunk, ignoring chunks without any.
+
+        Args:
+            text (str): Text of the chunk.
+        """
+
+        if not text:
+            return
+        self.tick()
+        if self.capture_response:
+            self.parts.append(text)
+            return
+        self.size += len(text.encode("utf-8"))
+        if self.count_words:
+            words = len(text.split())
+            if self._in_word and not text[0].isspace():
+                # The first word continues the last word of the previous chunk.
+                words -= 1
+            self._words += words
+            self._in_word = not text[-1].isspace()
+
+    def text(self):
+        """
+        Return the text streamed so far.
+
+        Returns:
+            str: The response text, None when responses are not captured.
+        """
+
+        if not self.capture_response:
+            return None
+        return "".join(self.parts)
+
+    def word_count(self):
+        """
+        Return the number of whitespace separated words streamed so far.
+
+        Returns:
+            int: The number of words.
+        """
+
+        if not self.capture_response:
+            return self._words
+        return len(self.text().split())
+
+    def response_fields(self):
+        """
+        Return the fields describing the response for the data sent to Doku.
+
+        Returns:
+            dict: The response text, or the number of chunks and bytes streamed
+            when responses are not captured.
+        """
+
+        if not self.capture_response:
+            return {"responseChunks": self.chunks, "responseBytes": self.size}
+        return {"response": self.text()}
+
+    def timing_fields(self):
+        """
+        Return the latency fields of the stream for the data sent to Doku.
+
+        Returns:
+            dict: Seconds to the first chunk, chunks per second from the first to
+            the last chunk, and the mean and maximum gap in seconds between
+            chunks. Empty if no chunk arrived.
+        """
+
+        if self.first_chunk_at is None:
+            return {}
+        fields = {"timeToFirstChunk": self.first_chunk_at - self.started}
+        if self.chunks > 1:
+            streaming = self.last_chunk_at - self.first_chunk_at
+            fields["interChunkGapMean"] = streaming / (self.chunks - 1)
+            fields["interChunkGapMax"] = self.max_gap
+            if streaming > 0:
+                fields["chunksPerSecond"] = (self.chunks - 1) / streaming
+        return fields
+
+def close_stream(stream):
+    """
+    Close a provider stream, releasing its connection, if it can be closed.
+
+    Args:
+        stream: The stream returned by the provider's client.
+    """
+
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+async def aclose_stream(stream):
+    """
+    Close an asynchronous provider stream, releasing its connection, if it can
+    be closed.
+
+    Args:
+        stream: The stream returned by the provider's client.
+    """
+
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is not None:
+        await close()
+
+class TracedStream:
+    """
+    Stands in for the stream returned by a provider's client, yielding its
+    chunks through the wrapper's generator.
+
+    The attributes of the provider's stream, such as `response`, stay
+    available. Closing it, directly or by leaving a `with` block, closes the
+    wrapper's generator, which closes the provider's stream and sends the data
+    of the chunks received so far.
+    """
+
+    def __init__(self, stream, chunks):
+        """
+        Initialize the proxy.
+
+        Args:
+            stream: The stream returned by the provider's client.
+            chunks (generator): The wrapper's generator iterating over `stream`.
+        """
+
+        self._stream = stream
+        self._chunks = chunks
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return self._chunks
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop the stream and release its connection.
+        """
+
+        self._chunks.close()
+        # The generator does not close the stream when it was never started.
+        close_stream(self._stream)
+
+class AsyncTracedStream:
+    """
+    Stands in for the asynchronous stream returned by a provider's client, see
+    `TracedStream`.
+    """
+
+    def __init__(self, stream, chunks):
+        """
+        Initialize the proxy.
+
+        Args:
+            stream: The stream returned by the provider's client.
+            chunks (async generator): The wrapper's generator iterating over `stream`.
+        """
+
+        self._stream = stream
+        self._chunks = chunks
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __aiter__(self):
+        return self._chunks
+
+    async def __anext__(self):
+        return await self._chunks.__anext__()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """
+        Stop the stream and release its connection.
+        """
+
+        await self._chunks.aclose()
+        await aclose_stream(self._stream)
+
+class TracedAudioStream:
+    """
+    Stands in for a response whose audio the caller streams, such as those of
+    `audio.speech.with_streaming_response.create`, counting the bytes of audio
+    as `iter_bytes` and `stream_to_file` yield them.
+
+    Closing it, directly or by leaving the `with` block, closes the response
+    and calls `on_close` once with the number of bytes read, or None when the
+    caller read the body in another way.
+    """
+
+    def __init__(self, response, on_close):
+        """
+        Initialize the proxy.
+
+        Args:
+            response: The response returned by the provider's client.
+            on_close (callable): Called with the number of bytes read.
+        """
+
+        self._response = response
+        self._on_close = on_close
+        self._size = None
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def iter_bytes(self, chunk_size=None):
+        """
+        Iterate over the audio, counting its bytes.
+
+        Args:
+            chunk_size (int): Size of the chunks, as the client chooses if None.
+
+        Yields:
+            bytes: The chunks of audio.
+        """
+
+        self._size = self._size or 0
+        for data in self._response.iter_bytes(chunk_size):
+            self._size += len(data)
+            yield data
+
+    def stream_to_file(self, file, *, chunk_size=None):
+        """
+        Write the audio to a file, counting its bytes.
+
+        Args:
+            file (str | os.PathLike): Path of the file.
+            chunk_size (int): Size of the chunks, as the client chooses if None.
+        """
+
+        with open(file, mode="wb") as output:
+            for data in self.iter_bytes(chunk_size):
+                output.write(data)
+
+    def close(self):
+        """
+        Close the response and send the data of the audio read so far.
+        """
+
+        close_stream(self._response)
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close(self._size)
+
+class AsyncTracedAudioStream:
+    """
+    Stands in for an asynchronous response whose audio the caller streams, see
+    `TracedAudioStream`.
+    """
+
+    def __init__(self, response, on_close):
+        """
+        Initialize the proxy.
+
+        Args:
+            response: The response returned by the provider's client.
+            on_close (coroutine function): Awaited with the number of bytes read.
+        """
+
+        self._response = response
+        self._on_close = on_close
+        self._size = None
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def iter_bytes(self, chunk_size=None):
+        """
+        Iterate over the audio, counting its bytes.
+
+        Args:
+            chunk_size (int): Size of the chunks, as the client chooses if None.
+
+        Yields:
+            bytes: The chunks of audio.
+        """
+
+        self._size = self._size or 0
+        async for data in self._response.iter_bytes(chunk_size):
+            self._size += len(data)
+            yield data
+
+    async def stream_to_file(self, file, *, chunk_size=None):
+        """
+        Write the audio to a file without blocking the event loop, counting its
+        bytes.
+
+        Args:
+            file (str | os.PathLike): Path of the file.
+            chunk_size (int): Size of the chunks, as the client chooses if None.
+        """
+
+        # The provider's client depends on anyio, this module does not.
+        import anyio # pylint: disable=import-outside-toplevel
+
+        async with await anyio.Path(file).open(mode="wb") as output:
+            async for data in self.iter_bytes(chunk_size):
+                await output.write(data)
+
+    async def close(self):
+        """
+        Close the response and send the data of the audio read so far.
+        """
+
+        await aclose_stream(self._response)
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            await on_close(self._size)
@@ -0,0 +1,110 @@
+"""
+Local agent that collects usage data from many processes and forwards it to Doku.
+
+Processes initialized with `dokumetry.init(..., agent_url=...)` send their events
+to the agent as fire-and-forget datagrams, over a UNIX domain socket or UDP on
+localhost. The agent batches, compresses and forwards them to the Doku Ingester,
+so a host with many worker processes keeps a single pool of connections to Doku.
+
+Run it with the `dokumetry-agent` command, e.g.:
+
+    dokumetry-agent --listen unix:///tmp/dokumetry.sock --doku-url http://doku:9044 \\
+        --api-key YOUR_DOKU_TOKEN --bulk-push --compression gzip
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+from .__exporter import Exporter, agent_address
+
+# Larger than any datagram a dokumetry process sends.
+MAX_RECEIVE_BYTES = 256 * 1024
+
+DEFAULT_LISTEN = "unix:///tmp/dokumetry.sock"
+
+def serve(listen, exporter, stop_event=None, ready_event=None):
+    """
+    Receive events on `listen` and hand them to `exporter` until `stop_event` is set.
+
+    Args:
+        listen (str): "unix:///path/to/socket" or "udp://host:port" to listen on.
+        exporter (Exporter): Exporter forwarding the events to Doku.
+        stop_event (threading.Event): Set to stop the agent, None to run forever.
+        ready_event (threading.Event): Set once the agent is listening.
+    """
+
+    family, address = agent_address(listen)
+    stop_event = stop_event or threading.Event()
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        sock.bind(address)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.settimeout(0.5)
+        exporter.start()
+        logging.info("DokuMetry: Agent listening on %s", listen)
+        if ready_event is not None:
+            ready_event.set()
+        while not stop_event.is_set():
+            try:
+                datagram = sock.recv(MAX_RECEIVE_BYTES)
+            except socket.timeout:
+                continue
+            for event in datagram.split(b"\n"):
+                if event:
+                    exporter.enqueue(event)
+    finally:
+        sock.close()
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        exporter.shutdown(timeout=exporter.timeout)
+
+def main(argv=None):
+    """
+    Entry point of the `dokumetry-agent` command.
+
+    Args:
+        argv (list): Command line arguments, defaults to `sys.argv[1:]`.
+    """
+
+    parser = argparse.ArgumentParser(prog="dokumetry-agent",
+                                     description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--listen", default=DEFAULT_LISTEN,
+                        help="unix:///path/to/socket or udp://127.0.0.1:port "
+                             f"(default {DEFAULT_LISTEN})")
+    parser.add_argument("--doku-url", default=os.getenv("DOKU_URL"),
+                        help="Doku Ingester URL (default $DOKU_URL)")
+    parser.add_argument("--api-key", default=os.getenv("DOKU_TOKEN"),
+                        help="Doku API key (default $DOKU_TOKEN)")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--max-queue-size", type=int, default=100000)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--bulk-push", action="store_true",
+                        help="send each batch as one JSON array request")
+    parser.add_argument("--compression", choices=["gzip", "zstd"])
+    parser.add_argument("--spool-dir", help="keep data Doku could not accept in this directory")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args(argv)
+    if not args.doku_url or not args.api_key:
+        parser.error("--doku-url and --api-key (or $DOKU_URL and $DOKU_TOKEN) are required")
+
+    logging.basicConfig(level=logging.INFO)
+    exporter = Exporter(args.doku_url, args.api_key, batch_size=args.batch_size,
+                        flush_interval=args.flush_interval, max_queue_size=args.max_queue_size,
+                        pool_size=args.pool_size, bulk_push=args.bulk_push,
+                        compression=args.compression, spool_dir=args.spool_dir,
+                        timeout=args.timeout)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    try:
+        serve(args.listen, exporter, stop_event)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
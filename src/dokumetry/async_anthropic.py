@@ -4,10 +4,14 @@ Module for monitoring Anthropic API calls.
 """
 
 import time
-from .__helpers import send_data
+from .__encoding import Deferred, StaticFields
+from .__formatting import format_messages
+from .__helpers import send_data_async
+from .__stream import aclose_stream, AsyncTracedStream, StreamAccumulator
 
 # pylint: disable=too-many-arguments,too-many-statements
-def init(llm, doku_url, api_key, environment, application_name, skip_resp):
+def init(llm, doku_url, api_key, environment, application_name, skip_resp,
+         capture_response=True):
     """
     Initialize Anthropic integration with Doku.
 
@@ -18,8 +22,12 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         environment (str): Doku environment.
         application_name (str): Doku application name.
         skip_resp (bool): Skip response processing.
+        capture_response (bool): Send the response of the LLM to Doku.
     """
 
+    static_fields = StaticFields(environment, application_name, skip_resp,
+                                 capture_response)
+
     original_messages_create = llm.messages.create
 
     #pylint: disable=too-many-locals
@@ -38,79 +46,49 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         start_time = time.time()
         #pylint: disable=no-else-return
         if streaming:
+            accumulator = StreamAccumulator(capture_response)
+            stream = await original_messages_create(*args, **kwargs)
             async def stream_generator():
-                accumulated_content = ""
-                async for event in await original_messages_create(*args, **kwargs):
-                    if event.type == "message_start":
-                        response_id = event.message.id
-                        prompt_tokens = event.message.usage.input_tokens
-                    if event.type == "content_block_delta":
-                        accumulated_content += event.delta.text
-                    if event.type == "message_delta":
-                        completion_tokens = event.usage.output_tokens
-                    yield event
-                end_time = time.time()
-                duration = end_time - start_time
-                message_prompt = kwargs.get('messages', "No prompt provided")
-                formatted_messages = []
-                for message in message_prompt:
-                    role = message["role"]
-                    content = message["content"]
-
-                    if isinstance(content, list):
-                        content_str = ", ".join(
-                            #pylint: disable=line-too-long
-                            f"{item['type']}: {item['text'] if 'text' in item else item['image_url']}"
-                            if 'type' in item else f"text: {item['text']}"
-                            for item in content
-                        )
-                        formatted_messages.append(f"{role}: {content_str}")
-                    else:
-                        formatted_messages.append(f"{role}: {content}")
-
-                prompt = "\n".join(formatted_messages)
-                data = {
-                    "llmReqId": response_id,
-                    "environment": environment,
-                    "applicationName": application_name,
-                    "sourceLanguage": "python",
-                    "endpoint": "anthropic.messages",
-                    "skipResp": skip_resp,
-                    "requestDuration": duration,
-                    "model": kwargs.get('model', "command"),
-                    "prompt": prompt,
-                    "response": accumulated_content,
-                    "promptTokens": prompt_tokens,
-                    "completionTokens": completion_tokens,
-                }
-                data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
-
-                send_data(data, doku_url, api_key)
-
-            return stream_generator()
+                response_id = None
+                prompt_tokens = 0
+                completion_tokens = 0
+                try:
+                    async for event in stream:
+                        if event.type == "message_start":
+                            response_id = event.message.id
+                            prompt_tokens = event.message.usage.input_tokens
+                        if event.type == "content_block_delta":
+                            accumulator.add(event.delta.text)
+                        if event.type == "message_delta":
+                            completion_tokens = event.usage.output_tokens
+                        yield event
+                finally:
+                    await aclose_stream(stream)
+                    end_time = time.time()
+                    duration = end_time - start_time
+                    prompt = Deferred(format_messages, list(kwargs.get('messages', [])))
+                    data = {
+                        "llmReqId": response_id,
+                        "endpoint": "anthropic.messages",
+                        "requestDuration": duration,
+                        "model": kwargs.get('model', "command"),
+                        "prompt": prompt,
+                        **accumulator.response_fields(),
+                        **accumulator.timing_fields(),
+                        "promptTokens": prompt_tokens,
+                        "completionTokens": completion_tokens,
+                    }
+                    data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
+
+                    await send_data_async(data, doku_url, api_key, static_fields)
+
+            return AsyncTracedStream(stream, stream_generator())
         else:
             start_time = time.time()
             response = await original_messages_create(*args, **kwargs)
             end_time = time.time()
             duration = end_time - start_time
-            message_prompt = kwargs.get('messages', "No prompt provided")
-            formatted_messages = []
-
-            for message in message_prompt:
-                role = message["role"]
-                content = message["content"]
-
-                if isinstance(content, list):
-                    content_str = ", ".join(
-                        f"{item['type']}: {item['text'] if 'text' in item else item['image_url']}"
-                        if 'type' in item else f"text: {item['text']}"
-                        for item in content
-                    )
-                    formatted_messages.append(f"{role}: {content_str}")
-                else:
-                    formatted_messages.append(f"{role}: {content}")
-
-            prompt = "\n".join(formatted_messages)
+            prompt = Deferred(format_messages, list(kwargs.get('messages', [])))
 
             model = kwargs.get('model')
 
@@ -119,11 +97,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
 
             data = {
                     "llmReqId": response.id,
-                    "environment": environment,
-                    "applicationName": application_name,
-                    "sourceLanguage": "python",
                     "endpoint": "anthropic.messages",
-                    "skipResp": skip_resp,
                     "completionTokens": completion_tokens,
                     "promptTokens": prompt_tokens,
                     "requestDuration": duration,
@@ -134,7 +108,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
             }
             data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
 
-            send_data(data, doku_url, api_key)
+            await send_data_async(data, doku_url, api_key, static_fields)
 
             return response
 
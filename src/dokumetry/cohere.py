@@ -4,7 +4,12 @@ Module for monitoring Cohere API calls.
 """
 
 import time
+from .__encoding import StaticFields
+from .__formatting import describe_inputs
 from .__helpers import send_data
+from .__stream import close_stream, StreamAccumulator, TracedStream
+
+TOKENS_PER_WORD = 1.5
 
 def count_tokens(text):
     """
@@ -16,18 +21,17 @@ def count_tokens(text):
     Returns:
         int: The number of tokens in the text.
     """
-    tokens_per_word = 1.5
-
     # Split the text into words
     words = text.split()
 
     # Calculate the number of tokens
-    num_tokens = round(len(words) * tokens_per_word)
+    num_tokens = round(len(words) * TOKENS_PER_WORD)
 
     return num_tokens
 
 # pylint: disable=too-many-arguments, too-many-statements
-def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pylint: disable=too-many-locals
+def init(llm, doku_url, api_key, environment, application_name, skip_resp,
+         capture_response=True, embedding_previews=3): #pylint: disable=too-many-locals
     """
     Initialize Cohere monitoring for Doku.
 
@@ -38,8 +42,13 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
         environment (str): Doku environment.
         application_name (str): Doku application name.
         skip_resp (bool): Skip response processing.
+        capture_response (bool): Send the response of the LLM to Doku.
+        embedding_previews (int): Number of embedding inputs previewed in the prompt.
     """
 
+    static_fields = StaticFields(environment, application_name, skip_resp,
+                                 capture_response)
+
     original_generate = llm.generate
     original_embed = llm.embed
     original_chat = llm.chat
@@ -61,32 +70,33 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
         start_time = time.time()
         #pylint: disable=no-else-return
         if streaming:
+            accumulator = StreamAccumulator(capture_response, count_words=True)
+            stream = original_generate(*args, **kwargs)
             def stream_generator():
-                accumulated_content = ""
-                for event in original_generate(*args, **kwargs):
-                    accumulated_content += event.text
-                    yield event
-                end_time = time.time()
-                duration = end_time - start_time
-                prompt = kwargs.get('prompt')
-                data = {
-                    "environment": environment,
-                    "applicationName": application_name,
-                    "sourceLanguage": "python",
-                    "endpoint": "cohere.generate",
-                    "skipResp": skip_resp,
-                    "requestDuration": duration,
-                    "model": kwargs.get('model', "command"),
-                    "prompt": prompt,
-                    "response": accumulated_content,
-                    "promptTokens": count_tokens(prompt),
-                    "completionTokens": count_tokens(accumulated_content),
-                }
-                data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
-
-                send_data(data, doku_url, api_key)
-
-            return stream_generator()
+                try:
+                    for event in stream:
+                        accumulator.add(event.text)
+                        yield event
+                finally:
+                    close_stream(stream)
+                    end_time = time.time()
+                    duration = end_time - start_time
+                    prompt = kwargs.get('prompt')
+                    data = {
+                        "endpoint": "cohere.generate",
+                        "requestDuration": duration,
+                        "model": kwargs.get('model', "command"),
+                        "prompt": prompt,
+                        **accumulator.response_fields(),
+                        **accumulator.timing_fields(),
+                        "promptTokens": count_tokens(prompt),
+                        "completionTokens": round(accumulator.word_count() * TOKENS_PER_WORD),
+                    }
+                    data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
+
+                    send_data(data, doku_url, api_key, static_fields)
+
+            return TracedStream(stream, stream_generator())
         else:
             start_time = time.time()
             response = original_generate(*args, **kwargs)
@@ -99,11 +109,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
             for generation in response.generations:
                 data = {
                     "llmReqId": generation.id,
-                    "environment": environment,
-                    "applicationName": application_name,
-                    "sourceLanguage": "python",
                     "endpoint": "cohere.generate",
-                    "skipResp": skip_resp,
                     "finishReason": generation.finish_reason,
                     "completionTokens": completion_tokens,
                     "promptTokens": prompt_tokens,
@@ -114,7 +120,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
                 }
                 data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
 
-                send_data(data, doku_url, api_key)
+                send_data(data, doku_url, api_key, static_fields)
 
             return response
 
@@ -135,21 +141,17 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
         end_time = time.time()
         duration = end_time - start_time
         model = kwargs.get('model', "embed-english-v2.0")
-        prompt = ' '.join(kwargs.get('texts', []))
+        inputs = describe_inputs(kwargs.get('texts', []), " ", embedding_previews)
 
         data = {
-            "environment": environment,
-            "applicationName": application_name,
-            "sourceLanguage": "python",
             "endpoint": "cohere.embed",
-            "skipResp": skip_resp,
             "requestDuration": duration,
             "model": model,
-            "prompt": prompt,
+            **inputs,
             "promptTokens": response.meta.billed_units.input_tokens,
         }
 
-        send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
@@ -168,36 +170,38 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
         start_time = time.time()
         #pylint: disable=no-else-return
         if streaming:
+            accumulator = StreamAccumulator(capture_response, count_words=True)
+            stream = original_chat(*args, **kwargs)
             def stream_generator():
-                accumulated_content = ""
-                for event in original_chat(*args, **kwargs):
-                    if event.event_type == "stream-start":
-                        response_id = event.generation_id
-                    if event.event_type == "text-generation":
-                        accumulated_content += event.text
-                    yield event
-                end_time = time.time()
-                duration = end_time - start_time
-                prompt = kwargs.get('message')
-                data = {
-                    "llmReqId": response_id,
-                    "environment": environment,
-                    "applicationName": application_name,
-                    "sourceLanguage": "python",
-                    "endpoint": "cohere.chat",
-                    "skipResp": skip_resp,
-                    "requestDuration": duration,
-                    "model": kwargs.get('model', "command"),
-                    "prompt": prompt,
-                    "response": accumulated_content,
-                    "promptTokens": count_tokens(prompt),
-                    "completionTokens": count_tokens(accumulated_content),
-                }
-                data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
-
-                send_data(data, doku_url, api_key)
-
-            return stream_generator()
+                response_id = None
+                try:
+                    for event in stream:
+                        if event.event_type == "stream-start":
+                            response_id = event.generation_id
+                        if event.event_type == "text-generation":
+                            accumulator.add(event.text)
+                        yield event
+                finally:
+                    close_stream(stream)
+                    end_time = time.time()
+                    duration = end_time - start_time
+                    prompt = kwargs.get('message')
+                    data = {
+                        "llmReqId": response_id,
+                        "endpoint": "cohere.chat",
+                        "requestDuration": duration,
+                        "model": kwargs.get('model', "command"),
+                        "prompt": prompt,
+                        **accumulator.response_fields(),
+                        **accumulator.timing_fields(),
+                        "promptTokens": count_tokens(prompt),
+                        "completionTokens": round(accumulator.word_count() * TOKENS_PER_WORD),
+                    }
+                    data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
+
+                    send_data(data, doku_url, api_key, static_fields)
+
+            return TracedStream(stream, stream_generator())
         else:
             start_time = time.time()
             response = original_chat(*args, **kwargs)
@@ -207,11 +211,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
             prompt = kwargs.get('message')
             data = {
                 "llmReqId": response.response_id,
-                "environment": environment,
-                "applicationName": application_name,
-                "sourceLanguage": "python",
                 "endpoint": "cohere.chat",
-                "skipResp": skip_resp,
                 "requestDuration": duration,
                 "prompt": prompt,
                 "model": model,
@@ -221,7 +221,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
                 "response": response.text
             }
 
-            send_data(data, doku_url, api_key)
+            send_data(data, doku_url, api_key, static_fields)
 
             return response
 
@@ -238,41 +238,51 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
             CohereResponse: The response from Cohere's chat_stream.
         """
         start_time = time.time()
+        # Only times the chunks, the response text comes with the last event.
+        accumulator = StreamAccumulator(capture_response=False)
+        stream = original_chat_stream(*args, **kwargs)
         def stream_generator():
             accumulated_content = ""
-            for event in original_chat_stream(*args, **kwargs):
-                if event.event_type == "stream-end":
-                    accumulated_content = event.response.text
-                    response_id = event.response.response_id
-                    prompt_tokens = event.response.meta["billed_units"]["input_tokens"]
-                    completion_tokens = event.response.meta["billed_units"]["output_tokens"]
-                    total_tokens = event.response.token_count["billed_tokens"]
-                    finish_reason = event.finish_reason
-                yield event
-            end_time = time.time()
-            duration = end_time - start_time
-            prompt = kwargs.get('message', "No prompt provided")
+            response_id = None
+            prompt_tokens = 0
+            completion_tokens = 0
+            total_tokens = 0
+            finish_reason = None
+            try:
+                for event in stream:
+                    if event.event_type == "text-generation":
+                        accumulator.tick()
+                    if event.event_type == "stream-end":
+                        accumulated_content = event.response.text
+                        response_id = event.response.response_id
+                        prompt_tokens = event.response.meta["billed_units"]["input_tokens"]
+                        completion_tokens = event.response.meta["billed_units"]["output_tokens"]
+                        total_tokens = event.response.token_count["billed_tokens"]
+                        finish_reason = event.finish_reason
+                    yield event
+            finally:
+                close_stream(stream)
+                end_time = time.time()
+                duration = end_time - start_time
+                prompt = kwargs.get('message', "No prompt provided")
 
-            data = {
-                "llmReqId": response_id,
-                "environment": environment,
-                "applicationName": application_name,
-                "sourceLanguage": "python",
-                "endpoint": "cohere.chat",
-                "skipResp": skip_resp,
-                "requestDuration": duration,
-                "model": kwargs.get('model', "command"),
-                "prompt": prompt,
-                "response": accumulated_content,
-                "promptTokens": prompt_tokens,
-                "completionTokens": completion_tokens,
-                "totalTokens": total_tokens,
-                "finishReason": finish_reason
-            }
+                data = {
+                    "llmReqId": response_id,
+                    "endpoint": "cohere.chat",
+                    "requestDuration": duration,
+                    "model": kwargs.get('model', "command"),
+                    "prompt": prompt,
+                    "response": accumulated_content,
+                    **accumulator.timing_fields(),
+                    "promptTokens": prompt_tokens,
+                    "completionTokens": completion_tokens,
+                    "totalTokens": total_tokens,
+                    "finishReason": finish_reason
+                }
 
-            send_data(data, doku_url, api_key)
+                send_data(data, doku_url, api_key, static_fields)
 
-        return stream_generator()
+        return TracedStream(stream, stream_generator())
 
 
     def summarize_generate(*args, **kwargs):
@@ -295,12 +305,8 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
         prompt = kwargs.get('text')
 
         data = {
-                "applicationName": application_name,
                 "llmReqId": response.id,
-                "environment": environment,
-                "sourceLanguage": "python",
                 "endpoint": "cohere.summarize",
-                "skipResp": skip_resp,
                 "requestDuration": duration,
                 "completionTokens": response.meta.billed_units.output_tokens,
                 "promptTokens": response.meta.billed_units.input_tokens,
@@ -310,7 +316,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp): #pyl
         }
         data["totalTokens"] = data["completionTokens"] + data["promptTokens"]
 
-        send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
@@ -4,10 +4,14 @@ Module for monitoring Mistral API calls.
 """
 
 import time
+from .__encoding import Deferred, StaticFields
+from .__formatting import describe_inputs, format_messages
 from .__helpers import send_data
+from .__stream import close_stream, StreamAccumulator, TracedStream
 
 # pylint: disable=too-many-arguments, too-many-statements
-def init(llm, doku_url, api_key, environment, application_name, skip_resp):
+def init(llm, doku_url, api_key, environment, application_name, skip_resp,
+         capture_response=True, embedding_previews=3):
     """
     Initialize Mistral integration with Doku.
 
@@ -18,8 +22,13 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         environment (str): Doku environment.
         application_name (str): Doku application name.
         skip_resp (bool): Skip response processing.
+        capture_response (bool): Send the response of the LLM to Doku.
+        embedding_previews (int): Number of embedding inputs previewed in the prompt.
     """
 
+    static_fields = StaticFields(environment, application_name, skip_resp,
+                                 capture_response)
+
     original_mistral_chat = llm.chat
     original_mistral_chat_stream = llm.chat_stream
     original_mistral_embeddings = llm.embeddings
@@ -40,24 +49,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         response = original_mistral_chat(*args, **kwargs)
         end_time = time.time()
         duration = end_time - start_time
-        message_prompt = kwargs.get('messages', "No prompt provided")
-        formatted_messages = []
-
-        for message in message_prompt:
-            role = message.role
-            content = message.content
-
-            if isinstance(content, list):
-                content_str = ", ".join(
-                    f"{item['type']}: {item['text'] if 'text' in item else item['image_url']}"
-                    if 'type' in item else f"text: {item['text']}"
-                    for item in content
-                )
-                formatted_messages.append(f"{role}: {content_str}")
-            else:
-                formatted_messages.append(f"{role}: {content}")
-
-        prompt = " ".join(formatted_messages)
+        prompt = Deferred(format_messages, list(kwargs.get('messages', [])), " ")
         model = kwargs.get('model')
 
         prompt_tokens = response.usage.prompt_tokens
@@ -66,11 +58,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
 
         data = {
                 "llmReqId": response.id,
-                "environment": environment,
-                "applicationName": application_name,
-                "sourceLanguage": "python",
                 "endpoint": "mistral.chat",
-                "skipResp": skip_resp,
                 "completionTokens": completion_tokens,
                 "promptTokens": prompt_tokens,
                 "totalTokens": total_tokens,
@@ -81,7 +69,7 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
                 "response": response.choices[0].message.content
         }
 
-        send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
@@ -98,58 +86,47 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
             MistalResponse: The response from Mistral's chat_stream.
         """
         start_time = time.time()
+        accumulator = StreamAccumulator(capture_response)
+        stream = original_mistral_chat_stream(*args, **kwargs)
         def stream_generator():
-            accumulated_content = ""
-            for event in original_mistral_chat_stream(*args, **kwargs):
-                response_id = event.id
-                accumulated_content += event.choices[0].delta.content
-                if event.usage is not None:
-                    prompt_tokens = event.usage.prompt_tokens
-                    completion_tokens = event.usage.completion_tokens
-                    total_tokens = event.usage.total_tokens
-                    finish_reason = event.choices[0].finish_reason
-                yield event
-            end_time = time.time()
-            duration = end_time - start_time
-            message_prompt = kwargs.get('messages', "No prompt provided")
-            formatted_messages = []
-
-            for message in message_prompt:
-                role = message.role
-                content = message.content
-
-                if isinstance(content, list):
-                    content_str = ", ".join(
-                        f"{item['type']}: {item['text'] if 'text' in item else item['image_url']}"
-                        if 'type' in item else f"text: {item['text']}"
-                        for item in content
-                    )
-                    formatted_messages.append(f"{role}: {content_str}")
-                else:
-                    formatted_messages.append(f"{role}: {content}")
-
-            prompt = " ".join(formatted_messages)
-
-            data = {
-                "llmReqId": response_id,
-                "environment": environment,
-                "applicationName": application_name,
-                "sourceLanguage": "python",
-                "endpoint": "mistral.chat",
-                "skipResp": skip_resp,
-                "requestDuration": duration,
-                "model": kwargs.get('model', "command"),
-                "prompt": prompt,
-                "response": accumulated_content,
-                "promptTokens": prompt_tokens,
-                "completionTokens": completion_tokens,
-                "totalTokens": total_tokens,
-                "finishReason": finish_reason
-            }
-
-            send_data(data, doku_url, api_key)
-
-        return stream_generator()
+            response_id = None
+            prompt_tokens = 0
+            completion_tokens = 0
+            total_tokens = 0
+            finish_reason = None
+            try:
+                for event in stream:
+                    response_id = event.id
+                    accumulator.add(event.choices[0].delta.content)
+                    if event.usage is not None:
+                        prompt_tokens = event.usage.prompt_tokens
+                        completion_tokens = event.usage.completion_tokens
+                        total_tokens = event.usage.total_tokens
+                        finish_reason = event.choices[0].finish_reason
+                    yield event
+            finally:
+                close_stream(stream)
+                end_time = time.time()
+                duration = end_time - start_time
+                prompt = Deferred(format_messages, list(kwargs.get('messages', [])), " ")
+
+                data = {
+                    "llmReqId": response_id,
+                    "endpoint": "mistral.chat",
+                    "requestDuration": duration,
+                    "model": kwargs.get('model', "command"),
+                    "prompt": prompt,
+                    **accumulator.response_fields(),
+                    **accumulator.timing_fields(),
+                    "promptTokens": prompt_tokens,
+                    "completionTokens": completion_tokens,
+                    "totalTokens": total_tokens,
+                    "finishReason": finish_reason
+                }
+
+                send_data(data, doku_url, api_key, static_fields)
+
+        return TracedStream(stream, stream_generator())
 
     def patched_embeddings(*args, **kwargs):
         """
@@ -168,24 +145,20 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         end_time = time.time()
         duration = end_time - start_time
         model = kwargs.get('model', "mistral-embed")
-        prompt = ', '.join(kwargs.get('input', []))
+        inputs = describe_inputs(kwargs.get('input', []), previews=embedding_previews)
 
         data = {
             "llmReqId": response.id,
-            "environment": environment,
-            "applicationName": application_name,
-            "sourceLanguage": "python",
             "endpoint": "mistral.embeddings",
-            "skipResp": skip_resp,
             "requestDuration": duration,
             "model": model,
-            "prompt": prompt,
+            **inputs,
             "promptTokens": response.usage.prompt_tokens,
             "completionTokens": response.usage.completion_tokens,
             "totalTokens": response.usage.total_tokens,
         }
 
-        send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
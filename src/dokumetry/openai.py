@@ -4,12 +4,17 @@ Module for monitoring OpenAI API calls.
 """
 
 import time
+from .__encoding import Deferred, StaticFields
+from .__formatting import describe_inputs, format_messages
 from .__helpers import send_data
+from .__media import describe_audio, describe_images, is_streamed
+from .__stream import close_stream, StreamAccumulator, TracedAudioStream, TracedStream
 
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-arguments
 # pylint: disable=too-many-statements
-def init(llm, doku_url, api_key, environment, application_name, skip_resp):
+def init(llm, doku_url, api_key, environment, application_name, skip_resp,
+         capture_response=True, capture_images=False, embedding_previews=3):
     """
     Initialize OpenAI monitoring for Doku.
 
@@ -20,8 +25,14 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         environment (str): Doku environment.
         application_name (str): Doku application name.
         skip_resp (bool): Skip response processing.
+        capture_response (bool): Send the response of the LLM to Doku.
+        capture_images (bool): Send generated images requested as base64 to Doku.
+        embedding_previews (int): Number of embedding inputs previewed in the prompt.
     """
 
+    static_fields = StaticFields(environment, application_name, skip_resp,
+                                 capture_response)
+
     original_chat_create = llm.chat.completions.create
     original_completions_create = llm.completions.create
     original_embeddings_create = llm.embeddings.create
@@ -45,85 +56,49 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         start_time = time.time()
         #pylint: disable=no-else-return
         if is_streaming:
+            accumulator = StreamAccumulator(capture_response)
+            stream = original_chat_create(*args, **kwargs)
             def stream_generator():
-                accumulated_content = ""
-                for chunk in original_chat_create(*args, **kwargs):
-                    if len(chunk.choices) > 0:
-                        #pylint: disable=line-too-long
-                        if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
-                            content = chunk.choices[0].delta.content
-                            if content:
-                                accumulated_content += content
-                    yield chunk
-                    response_id = chunk.id
-                end_time = time.time()
-                duration = end_time - start_time
-                message_prompt = kwargs.get('messages', "No prompt provided")
-                formatted_messages = []
-                for message in message_prompt:
-                    role = message["role"]
-                    content = message["content"]
-
-                    if isinstance(content, list):
-                        content_str = ", ".join(
+                response_id = None
+                try:
+                    for chunk in stream:
+                        if len(chunk.choices) > 0:
                             #pylint: disable=line-too-long
-                            f"{item['type']}: {item['text'] if 'text' in item else item['image_url']}"
-                            if 'type' in item else f"text: {item['text']}"
-                            for item in content
-                        )
-                        formatted_messages.append(f"{role}: {content_str}")
-                    else:
-                        formatted_messages.append(f"{role}: {content}")
-
-                prompt = "\n".join(formatted_messages)
-                data = {
-                    "environment": environment,
-                    "llmReqId": response_id,
-                    "applicationName": application_name,
-                    "sourceLanguage": "python",
-                    "endpoint": "openai.chat.completions",
-                    "skipResp": skip_resp,
-                    "requestDuration": duration,
-                    "model": kwargs.get('model', "No Model provided"),
-                    "prompt": prompt,
-                    "response": accumulated_content,
-                }
-
-                send_data(data, doku_url, api_key)
-
-            return stream_generator()
+                            if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
+                                content = chunk.choices[0].delta.content
+                                if content:
+                                    accumulator.add(content)
+                        response_id = chunk.id
+                        yield chunk
+                finally:
+                    close_stream(stream)
+                    end_time = time.time()
+                    duration = end_time - start_time
+                    prompt = Deferred(format_messages, list(kwargs.get('messages', [])))
+                    data = {
+                        "llmReqId": response_id,
+                        "endpoint": "openai.chat.completions",
+                        "requestDuration": duration,
+                        "model": kwargs.get('model', "No Model provided"),
+                        "prompt": prompt,
+                        **accumulator.response_fields(),
+                        **accumulator.timing_fields(),
+                    }
+
+                    send_data(data, doku_url, api_key, static_fields)
+
+            return TracedStream(stream, stream_generator())
         else:
             start_time = time.time()
             response = original_chat_create(*args, **kwargs)
             end_time = time.time()
             duration = end_time - start_time
             model = kwargs.get('model', "No Model provided")
-            message_prompt = kwargs.get('messages', "No prompt provided")
-            formatted_messages = []
-
-            for message in message_prompt:
-                role = message["role"]
-                content = message["content"]
-
-                if isinstance(content, list):
-                    content_str = ", ".join(
-                        f"{item['type']}: {item['text'] if 'text' in item else item['image_url']}"
-                        if 'type' in item else f"text: {item['text']}"
-                        for item in content
-                    )
-                    formatted_messages.append(f"{role}: {content_str}")
-                else:
-                    formatted_messages.append(f"{role}: {content}")
-
-            prompt = "\n".join(formatted_messages)
+            prompt = Deferred(format_messages, list(kwargs.get('messages', [])))
 
             data = {
                 "llmReqId": response.id,
                 "endpoint": "openai.chat.completions",
-                "environment": environment,
-                "applicationName": application_name,
-                "sourceLanguage": "python",
-                "skipResp": skip_resp,
                 "requestDuration": duration,
                 "model": model,
                 "prompt": prompt,
@@ -135,22 +110,19 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
                 data["totalTokens"] = response.usage.total_tokens
                 data["finishReason"] = response.choices[0].finish_reason
 
-                if "n" not in kwargs or kwargs["n"] == 1:
-                    data["response"] = response.choices[0].message.content
-                else:
-                    i = 0
-                    while i < kwargs["n"]:
-                        data["response"] = response.choices[i].message.content
-                        i += 1
-                        send_data(data, doku_url, api_key)
-                    return response
+                data["response"] = response.choices[0].message.content
+                if len(response.choices) > 1:
+                    # One event for all choices of an n > 1 request.
+                    data["choices"] = [{"response": choice.message.content,
+                                         "finishReason": choice.finish_reason}
+                                        for choice in response.choices]
             elif "tools" in kwargs:
                 data["response"] = "Function called with tools"
                 data["completionTokens"] = response.usage.completion_tokens
                 data["promptTokens"] = response.usage.prompt_tokens
                 data["totalTokens"] = response.usage.total_tokens
 
-            send_data(data, doku_url, api_key)
+            send_data(data, doku_url, api_key, static_fields)
 
             return response
 
@@ -169,35 +141,37 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         streaming = kwargs.get('stream', False)
         #pylint: disable=no-else-return
         if streaming:
+            accumulator = StreamAccumulator(capture_response)
+            stream = original_completions_create(*args, **kwargs)
             def stream_generator():
-                accumulated_content = ""
-                for chunk in original_completions_create(*args, **kwargs):
-                    if len(chunk.choices) > 0:
-                        if hasattr(chunk.choices[0], 'text'):
-                            content = chunk.choices[0].text
-                            if content:
-                                accumulated_content += content
-                    yield chunk
-                    response_id = chunk.id
-                end_time = time.time()
-                duration = end_time - start_time
-                prompt = kwargs.get('prompt', "No prompt provided")
-                data = {
-                    "endpoint": "openai.completions",
-                    "llmReqId": response_id,
-                    "environment": environment,
-                    "applicationName": application_name,
-                    "sourceLanguage": "python",
-                    "skipResp": skip_resp,
-                    "requestDuration": duration,
-                    "model": kwargs.get('model', "No Model provided"),
-                    "prompt": prompt,
-                    "response": accumulated_content,
-                }
-
-                send_data(data, doku_url, api_key)
-
-            return stream_generator()
+                response_id = None
+                try:
+                    for chunk in stream:
+                        if len(chunk.choices) > 0:
+                            if hasattr(chunk.choices[0], 'text'):
+                                content = chunk.choices[0].text
+                                if content:
+                                    accumulator.add(content)
+                        response_id = chunk.id
+                        yield chunk
+                finally:
+                    close_stream(stream)
+                    end_time = time.time()
+                    duration = end_time - start_time
+                    prompt = kwargs.get('prompt', "No prompt provided")
+                    data = {
+                        "endpoint": "openai.completions",
+                        "llmReqId": response_id,
+                        "requestDuration": duration,
+                        "model": kwargs.get('model', "No Model provided"),
+                        "prompt": prompt,
+                        **accumulator.response_fields(),
+                        **accumulator.timing_fields(),
+                    }
+
+                    send_data(data, doku_url, api_key, static_fields)
+
+            return TracedStream(stream, stream_generator())
         else:
             start_time = time.time()
             response = original_completions_create(*args, **kwargs)
@@ -207,12 +181,8 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
             prompt = kwargs.get('prompt', "No prompt provided")
 
             data = {
-                "environment": environment,
-                "applicationName": application_name,
                 "llmReqId": response.id,
-                "sourceLanguage": "python",
                 "endpoint": "openai.completions",
-                "skipResp": skip_resp,
                 "requestDuration": duration,
                 "model": model,
                 "prompt": prompt,
@@ -224,22 +194,19 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
                 data["totalTokens"] = response.usage.total_tokens
                 data["finishReason"] = response.choices[0].finish_reason
 
-                if "n" not in kwargs or kwargs["n"] == 1:
-                    data["response"] = response.choices[0].text
-                else:
-                    i = 0
-                    while i < kwargs["n"]:
-                        data["response"] = response.choices[i].text
-                        i += 1
-                        send_data(data, doku_url, api_key)
-                    return response
+                data["response"] = response.choices[0].text
+                if len(response.choices) > 1:
+                    # One event for all choices of an n > 1 request.
+                    data["choices"] = [{"response": choice.text,
+                                         "finishReason": choice.finish_reason}
+                                        for choice in response.choices]
             elif "tools" in kwargs:
                 data["response"] = "Function called with tools"
                 data["completionTokens"] = response.usage.completion_tokens
                 data["promptTokens"] = response.usage.prompt_tokens
                 data["totalTokens"] = response.usage.total_tokens
 
-            send_data(data, doku_url, api_key)
+            send_data(data, doku_url, api_key, static_fields)
 
             return response
 
@@ -260,22 +227,18 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         end_time = time.time()
         duration = end_time - start_time
         model = kwargs.get('model', "No Model provided")
-        prompt = ', '.join(kwargs.get('input', []))
+        inputs = describe_inputs(kwargs.get('input', []), previews=embedding_previews)
 
         data = {
-            "environment": environment,
-            "applicationName": application_name,
-            "sourceLanguage": "python",
             "endpoint": "openai.embeddings",
-            "skipResp": skip_resp,
             "requestDuration": duration,
             "model": model,
-            "prompt": prompt,
+            **inputs,
             "promptTokens": response.usage.prompt_tokens,
             "totalTokens": response.usage.total_tokens
         }
 
-        send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
@@ -298,18 +261,14 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         model = kwargs.get('model', "No Model provided")
 
         data = {
-            "environment": environment,
-            "applicationName": application_name,
-            "sourceLanguage": "python",
             "endpoint": "openai.fine_tuning",
-            "skipResp": skip_resp,
             "requestDuration": duration,
             "model": model,
             "llmReqId": response.id,
             "finetuneJobStatus": response.status,
         }
 
-        send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
@@ -346,24 +305,20 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         else:
             quality = kwargs['quality']
 
-        for items in response.data:
-            data = {
-                "llmReqId": response.created,
-                "environment": environment,
-                "applicationName": application_name,
-                "sourceLanguage": "python",
-                "endpoint": "openai.images.create",
-                "skipResp": skip_resp,
-                "requestDuration": duration,
-                "model": model,
-                "prompt": prompt,
-                "imageSize": size,
-                "imageQuality": quality,
-                "revisedPrompt": items.revised_prompt,
-                "image": getattr(items, image)
-            }
+        revised_prompt = response.data[0].revised_prompt if response.data else None
+        data = {
+            "llmReqId": response.created,
+            "endpoint": "openai.images.create",
+            "requestDuration": duration,
+            "model": model,
+            "prompt": prompt,
+            "imageSize": size,
+            "imageQuality": quality,
+            "revisedPrompt": revised_prompt,
+            **describe_images(response.data, image, capture_images),
+        }
 
-            send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
@@ -394,24 +349,19 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
         else:
             image = "url"
 
-        for items in response.data:
-
-            data = {
-                "llmReqId": response.created,
-                "environment": environment,
-                "applicationName": application_name,
-                "sourceLanguage": "python",
-                "endpoint": "openai.images.create.variations",
-                "skipResp": skip_resp,
-                "requestDuration": duration,
-                "model": model,
-                "imageSize": size,
-                "imageQuality": "standard",
-                "revisedPrompt": items.revised_prompt,
-                "image": getattr(items, image)
-            }
+        revised_prompt = response.data[0].revised_prompt if response.data else None
+        data = {
+            "llmReqId": response.created,
+            "endpoint": "openai.images.create.variations",
+            "requestDuration": duration,
+            "model": model,
+            "imageSize": size,
+            "imageQuality": "standard",
+            "revisedPrompt": revised_prompt,
+            **describe_images(response.data, image, capture_images),
+        }
 
-            send_data(data, doku_url, api_key)
+        send_data(data, doku_url, api_key, static_fields)
 
         return response
 
@@ -429,25 +379,29 @@ def init(llm, doku_url, api_key, environment, application_name, skip_resp):
 
         start_time = time.time()
         response = original_audio_speech_create(*args, **kwargs)
-        end_time = time.time()
-        duration = end_time - start_time
         model = kwargs.get('model', "No Model provided")
         prompt = kwargs.get('input', "No prompt provided")
         voice = kwargs.get('voice')
 
-        data = {
-            "environment": environment,
-            "applicationName": application_name,
-            "sourceLanguage": "python",
-            "endpoint": "openai.audio.speech.create",
-            "skipResp": skip_resp,
-            "requestDuration": duration,
-            "model": model,
-            "prompt": prompt,
-            "audioVoice": voice,
-        }
+        def send_audio(size=None):
+            end_time = time.time()
+            duration = end_time - start_time
+            data = {
+                "endpoint": "openai.audio.speech.create",
+                "requestDuration": duration,
+                "model": model,
+                "prompt": prompt,
+                "audioVoice": voice,
+                **describe_audio(response, duration, size),
+            }
+
+            send_data(data, doku_url, api_key, static_fields)
+
+        if is_streamed(response):
+            # The caller streams the audio, the data is sent once it is closed.
+            return TracedAudioStream(response, send_audio)
 
-        send_data(data, doku_url, api_key)
+        send_audio()
 
         return response
 
@@ -0,0 +1,123 @@
+"""
+Shared pytest fixtures.
+
+Provides a local stand-in for the Doku Ingester so that the exporter can be
+tested without a running Doku stack.
+"""
+
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+# pylint: disable=too-many-instance-attributes, too-few-public-methods
+class StandInIngester:
+    """
+    Minimal HTTP server implementing the Doku Ingester push API.
+
+    A push body is either a single JSON event or a JSON array of events,
+    optionally gzip compressed.
+
+    Attributes:
+        url (str): Base URL to pass as `doku_url`.
+        events (list): Events received, in arrival order.
+        requests (list): Headers of each push request received.
+        connections (list): Client address of each request received, warm-ups included.
+        delay (float): Seconds to wait before answering a push.
+        status (int): HTTP status code to answer pushes with.
+        failures (int): Number of the next pushes to answer with 503 instead.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.requests = []
+        self.connections = []
+        self.delay = 0.0
+        self.status = 201
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _handler(self):
+        ingester = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Request handler for the stand-in ingester.
+            """
+
+            protocol_version = "HTTP/1.1"
+
+            # pylint: disable=invalid-name
+            def do_HEAD(self):
+                """
+                Handle a connection warm-up request.
+                """
+                with ingester.lock:
+                    ingester.connections.append(self.client_address)
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            # pylint: disable=invalid-name
+            def do_POST(self):
+                """
+                Handle a push request.
+                """
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                with ingester.lock:
+                    ingester.connections.append(self.client_address)
+                    status = ingester.status
+                    if ingester.failures:
+                        ingester.failures -= 1
+                        status = 503
+                if ingester.delay:
+                    time.sleep(ingester.delay)
+                if self.path == "/api/push" and status < 400:
+                    with ingester.lock:
+                        ingester.requests.append(dict(self.headers))
+                        payload = json.loads(body)
+                        if isinstance(payload, list):
+                            ingester.events.extend(payload)
+                        else:
+                            ingester.events.append(payload)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """
+                Silence per-request logging.
+                """
+
+        return Handler
+
+    def wait_for(self, count, timeout=5.0):
+        """
+        Wait until at least `count` events have been received.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.events) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+@pytest.fixture
+def doku_ingester():
+    """
+    Run a stand-in Doku Ingester for the duration of a test.
+    """
+    ingester = StandInIngester()
+    ingester.thread.start()
+    yield ingester
+    ingester.server.shutdown()
+    ingester.server.server_close()
@@ -0,0 +1,493 @@
+"""
+Exporter Test Suite
+
+This module contains tests for the background exporter that ships the
+collected data to Doku. The tests run against a local stand-in for the
+Doku Ingester (see `conftest.py`), so no Doku stack or LLM API keys are needed.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import pytest
+import dokumetry.__exporter as exporter_module
+from dokumetry.__exporter import Exporter, configure_exporter, pack_events
+from dokumetry.__encoding import Deferred, StaticFields
+from dokumetry.__spool import Spool
+from dokumetry.__breaker import CircuitBreaker
+from dokumetry.agent import serve
+
+def test_enqueue_does_not_wait_for_ingester(doku_ingester):
+    """
+    Test that queuing an event returns before a slow ingester answers.
+    """
+    doku_ingester.delay = 0.5
+    exporter = Exporter(doku_ingester.url, "key", flush_interval=0.01)
+
+    start = time.monotonic()
+    assert exporter.enqueue({"endpoint": "openai.chat.completions"})
+    assert time.monotonic() - start < 0.1
+
+    assert exporter.shutdown(timeout=5)
+    assert doku_ingester.events == [{"endpoint": "openai.chat.completions"}]
+    assert doku_ingester.requests[0]["Authorization"] == "key"
+
+def test_flush_sends_pending_batch(doku_ingester):
+    """
+    Test that flush sends events before the batch is full or old.
+    """
+    exporter = Exporter(doku_ingester.url, "key", batch_size=100, flush_interval=60)
+    for i in range(3):
+        exporter.enqueue({"llmReqId": i})
+
+    assert exporter.flush(timeout=5)
+    assert [event["llmReqId"] for event in doku_ingester.events] == [0, 1, 2]
+    exporter.shutdown(timeout=5)
+
+def test_batch_flushed_by_age(doku_ingester):
+    """
+    Test that a partial batch is flushed once it is `flush_interval` old.
+    """
+    exporter = Exporter(doku_ingester.url, "key", batch_size=100, flush_interval=0.05)
+    exporter.enqueue({"llmReqId": 1})
+
+    assert doku_ingester.wait_for(1)
+    exporter.shutdown(timeout=5)
+
+def test_full_queue_drops_events(doku_ingester):
+    """
+    Test that events are dropped, not blocked on, once the queue is full.
+    """
+    doku_ingester.delay = 0.2
+    exporter = Exporter(doku_ingester.url, "key", batch_size=1, max_queue_size=1)
+    results = [exporter.enqueue({"llmReqId": i}) for i in range(20)]
+
+    assert not all(results)
+    assert exporter.dropped == results.count(False)
+    exporter.shutdown(timeout=5)
+
+def test_async_enqueue_delivers_from_event_loop(doku_ingester):
+    """
+    Test that events queued from a coroutine are sent by the loop's exporter.
+    """
+    exporter = Exporter(doku_ingester.url, "key", flush_interval=0.01)
+
+    async def main():
+        for i in range(3):
+            assert exporter.enqueue_async({"llmReqId": i})
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert exporter.flush(timeout=5)
+    assert sorted(event["llmReqId"] for event in doku_ingester.events) == [0, 1, 2]
+
+def test_async_enqueue_with_several_event_loops(doku_ingester):
+    """
+    Test that loops running in different threads each get their own queue.
+    """
+    exporter = Exporter(doku_ingester.url, "key", flush_interval=0.01)
+
+    async def main(thread_id):
+        for i in range(5):
+            exporter.enqueue_async({"llmReqId": f"{thread_id}-{i}"})
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+
+    threads = [threading.Thread(target=asyncio.run, args=(main(t),)) for t in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert exporter.flush(timeout=5)
+    assert len(doku_ingester.events) == 20
+    assert len({event["llmReqId"] for event in doku_ingester.events}) == 20
+
+def test_async_compression_runs_off_event_loop(doku_ingester):
+    """
+    Test that the exporter of an event loop compresses request bodies in an executor.
+    """
+    exporter = Exporter(doku_ingester.url, "key", compression="gzip", compression_threshold=0)
+    compress = exporter.compress
+    threads = []
+
+    def record_thread(body):
+        threads.append(threading.current_thread())
+        return compress(body)
+
+    exporter.compress = record_thread
+
+    async def main():
+        exporter.enqueue_async({"llmReqId": 1})
+        await exporter._loop_exporters[asyncio.get_running_loop()].flush() # pylint: disable=protected-access
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(main())
+    assert doku_ingester.events == [{"llmReqId": 1}]
+    assert threads and loop_thread not in threads
+    exporter.shutdown(timeout=5)
+
+def test_async_queue_handed_off_when_loop_shuts_down(doku_ingester):
+    """
+    Test that events still queued when the loop stops are sent by the worker thread.
+    """
+    exporter = Exporter(doku_ingester.url, "key", flush_interval=60)
+
+    async def main():
+        exporter.enqueue_async({"llmReqId": "pending"})
+
+    asyncio.run(main())
+    assert exporter.flush(timeout=5)
+    assert doku_ingester.events == [{"llmReqId": "pending"}]
+
+def test_start_warms_up_and_reuses_connection(doku_ingester):
+    """
+    Test that the exporter connects at start and sends every batch over that connection.
+    """
+    exporter = Exporter(doku_ingester.url, "key")
+    exporter.start()
+    for i in range(3):
+        exporter.enqueue({"llmReqId": i})
+        assert exporter.flush(timeout=5)
+
+    assert len(doku_ingester.events) == 3
+    assert len(doku_ingester.connections) == 4
+    assert len(set(doku_ingester.connections)) == 1
+    exporter.shutdown(timeout=5)
+
+def test_bulk_push_sends_batch_in_one_request(doku_ingester):
+    """
+    Test that bulk push packs a batch into a single JSON array request.
+    """
+    exporter = Exporter(doku_ingester.url, "key", flush_interval=60, bulk_push=True)
+    for i in range(5):
+        exporter.enqueue({"llmReqId": i})
+
+    assert exporter.flush(timeout=5)
+    assert [event["llmReqId"] for event in doku_ingester.events] == [0, 1, 2, 3, 4]
+    assert len(doku_ingester.requests) == 1
+    exporter.shutdown(timeout=5)
+
+def test_pack_events_limits_count_and_size():
+    """
+    Test that bulk groups respect the event count and byte size limits.
+    """
+    events = [b'{"i":1}', b'{"i":2}', b'{"i":3}', b'{"prompt":"' + b"x" * 50 + b'"}']
+
+    assert pack_events(events, 2, 1000) == [events[:2], events[2:]]
+    assert pack_events(events, 10, 20) == [events[:2], [events[2]], [events[3]]]
+
+def test_static_fields_spliced_into_events(doku_ingester):
+    """
+    Test that pre-encoded static fields are added to events queued with them.
+    """
+    static_fields = StaticFields("production", "chatbot", False)
+    exporter = Exporter(doku_ingester.url, "key")
+    exporter.enqueue({"endpoint": "openai.embeddings", "prompt": "caf\u00e9"}, static_fields)
+    exporter.enqueue({}, static_fields)
+
+    assert exporter.flush(timeout=5)
+    assert doku_ingester.events == [
+        {"environment": "production", "applicationName": "chatbot", "sourceLanguage": "python",
+         "skipResp": False, "endpoint": "openai.embeddings", "prompt": "caf\u00e9"},
+        {"environment": "production", "applicationName": "chatbot", "sourceLanguage": "python",
+         "skipResp": False},
+    ]
+    exporter.shutdown(timeout=5)
+
+def test_deferred_values_resolved_by_worker(doku_ingester):
+    """
+    Test that deferred values are computed off the caller's thread when encoding.
+    """
+    threads = []
+
+    def format_prompt(messages):
+        threads.append(threading.current_thread())
+        return "\n".join(messages)
+
+    exporter = Exporter(doku_ingester.url, "key")
+    exporter.enqueue({"prompt": Deferred(format_prompt, ["user: Hi", "assistant: Hello"])})
+
+    assert exporter.flush(timeout=5)
+    assert doku_ingester.events == [{"prompt": "user: Hi\nassistant: Hello"}]
+    assert threads and threading.current_thread() not in threads
+    exporter.shutdown(timeout=5)
+
+def test_compression_above_threshold(doku_ingester):
+    """
+    Test that large bodies are gzip compressed, small ones are not, and the ratio is reported.
+    """
+    exporter = Exporter(doku_ingester.url, "key", compression="gzip",
+                        compression_threshold=1024)
+    exporter.enqueue({"prompt": "short"})
+    exporter.enqueue({"prompt": "retrieved context " * 2000})
+
+    assert exporter.flush(timeout=5)
+    assert doku_ingester.events[1]["prompt"] == "retrieved context " * 2000
+    assert "Content-Encoding" not in doku_ingester.requests[0]
+    assert doku_ingester.requests[1]["Content-Encoding"] == "gzip"
+    assert exporter.stats()["compression_ratio"] > 10
+    exporter.shutdown(timeout=5)
+
+def test_failed_events_are_spooled_and_replayed(doku_ingester, tmp_path):
+    """
+    Test that events Doku rejects with a server error are replayed from the spool.
+    """
+    doku_ingester.status = 503
+    exporter = Exporter(doku_ingester.url, "key", bulk_push=True, spool_dir=str(tmp_path),
+                        replay_interval=0.05)
+    for i in range(3):
+        exporter.enqueue({"llmReqId": i})
+    assert exporter.flush(timeout=5)
+    assert doku_ingester.events == []
+    assert exporter.spool.size() > 0
+
+    doku_ingester.status = 201
+    assert doku_ingester.wait_for(3)
+    assert sorted(event["llmReqId"] for event in doku_ingester.events) == [0, 1, 2]
+    exporter.shutdown(timeout=5)
+    assert not list(tmp_path.iterdir())
+
+def test_one_failed_request_does_not_fail_the_batch(doku_ingester):
+    """
+    Test that the groups after a failed push are still sent, by threads and event loops.
+    """
+    doku_ingester.failures = 1
+    exporter = Exporter(doku_ingester.url, "key", flush_interval=60)
+    for i in range(50):
+        exporter.enqueue({"llmReqId": i})
+    assert exporter.flush(timeout=5)
+    assert len(doku_ingester.events) == 49
+    assert exporter.stats()["undelivered"] == 1
+
+    doku_ingester.failures = 1
+
+    async def main():
+        for i in range(50):
+            exporter.enqueue_async({"llmReqId": i})
+        await exporter._loop_exporters[asyncio.get_running_loop()].flush() # pylint: disable=protected-access
+
+    asyncio.run(main())
+    assert len(doku_ingester.events) == 98
+    assert exporter.stats()["undelivered"] == 2
+    exporter.shutdown(timeout=5)
+
+def test_client_errors_are_not_spooled(doku_ingester, tmp_path):
+    """
+    Test that events rejected with a client error, e.g. a wrong api_key, are not retried.
+    """
+    doku_ingester.status = 401
+    exporter = Exporter(doku_ingester.url, "key", spool_dir=str(tmp_path))
+    exporter.enqueue({"llmReqId": 1})
+
+    assert exporter.flush(timeout=5)
+    assert exporter.spool.size() == 0
+    exporter.shutdown(timeout=5)
+
+def test_spool_write_errors_count_events_undelivered(doku_ingester, tmp_path):
+    """
+    Test that events the spool cannot write, e.g. on a full disk, are counted and not retried.
+    """
+    doku_ingester.status = 503
+    exporter = Exporter(doku_ingester.url, "key", spool_dir=str(tmp_path), replay_interval=60)
+
+    def disk_full(events):
+        raise OSError(28, "No space left on device")
+
+    exporter.spool.append = disk_full
+    exporter.enqueue({"llmReqId": 1})
+    assert exporter.flush(timeout=5)
+    exporter.enqueue({"llmReqId": 2})
+    assert exporter.flush(timeout=5)
+    assert exporter.stats()["undelivered"] == 2
+    exporter.shutdown(timeout=5)
+
+def test_async_spool_write_errors_count_events_undelivered(doku_ingester, tmp_path):
+    """
+    Test that a spool write error does not stop the exporter of an event loop.
+    """
+    doku_ingester.status = 503
+    exporter = Exporter(doku_ingester.url, "key", spool_dir=str(tmp_path), replay_interval=60,
+                        flush_interval=0.01)
+
+    def disk_full(events):
+        raise OSError(28, "No space left on device")
+
+    async def main():
+        exporter.spool.append = disk_full
+        for i in range(2):
+            exporter.enqueue_async({"llmReqId": i})
+            await asyncio.sleep(0.3)
+        return exporter.stats()["undelivered"]
+
+    assert asyncio.run(main()) == 2
+    exporter.shutdown(timeout=5)
+
+def test_spool_recovers_segments_of_dead_processes(tmp_path):
+    """
+    Test that a segment left open by a crashed process is replayed without its torn last line.
+    """
+    dead_pid = 2 ** 22 + 1
+    segment = tmp_path / f"{time.time_ns():020d}-{dead_pid}-1.spool.open"
+    segment.write_bytes(b'{"llmReqId":1}\n{"llmReqId":2}\n{"llmReq')
+
+    spool = Spool(str(tmp_path))
+    path = spool.claim()
+    assert Spool.read(path) == [b'{"llmReqId":1}', b'{"llmReqId":2}']
+    assert spool.claim() is None
+    spool.release(path)
+    assert not list(tmp_path.iterdir())
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs flock")
+def test_spool_recovers_segments_of_earlier_process_with_same_pid(tmp_path):
+    """
+    Test that segments left by a process whose PID was reused, e.g. in a restarted
+    container, are replayed while segments in use are left alone.
+    """
+    pid = os.getpid()
+    (tmp_path / f"{time.time_ns():020d}-{pid}-1.spool.open").write_bytes(b'{"llmReqId":1}\n')
+    (tmp_path / f"{time.time_ns():020d}-{pid}-2.spool.replay-{pid}").write_bytes(
+        b'{"llmReqId":2}\n')
+
+    in_use = Spool(str(tmp_path))
+    in_use.append([b'{"llmReqId":3}'])
+    spool = Spool(str(tmp_path))
+    paths = [spool.claim(), spool.claim()]
+    assert [Spool.read(path) for path in paths] == [[b'{"llmReqId":1}'], [b'{"llmReqId":2}']]
+    assert spool.claim() is None
+    for path in paths:
+        spool.release(path)
+    in_use.close()
+    assert Spool.read(spool.claim()) == [b'{"llmReqId":3}']
+
+def test_circuit_breaker_opens_and_probes_with_backoff():
+    """
+    Test that the breaker opens after consecutive failures and lets one probe through later.
+    """
+    breaker = CircuitBreaker(failure_threshold=2, base_delay=0.05, max_delay=1.0)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == "closed"
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+def test_open_breaker_sheds_without_waiting(doku_ingester):
+    """
+    Test that with Doku unreachable, events are shed without waiting on the timeout.
+    """
+    doku_ingester.delay = 0.5
+    exporter = Exporter(doku_ingester.url, "key", timeout=0.1, failure_threshold=2,
+                        max_backoff=60)
+    for i in range(2):
+        exporter.enqueue({"llmReqId": i})
+        exporter.flush(timeout=5)
+    assert exporter.stats()["circuit_state"] == "open"
+
+    start = time.monotonic()
+    for i in range(10):
+        exporter.enqueue({"llmReqId": i})
+    assert exporter.flush(timeout=5)
+    assert time.monotonic() - start < 0.1
+    assert exporter.stats()["undelivered"] == 12
+    exporter.shutdown(timeout=5)
+
+def test_configure_exporter_reuses_exporter_with_fallback_options(doku_ingester, monkeypatch):
+    """
+    Test that configuring an exporter again with options it fell back from keeps it.
+    """
+    monkeypatch.setattr(exporter_module, "zstandard", None)
+    monkeypatch.setattr(exporter_module, "http2_available", lambda: False)
+    exporter = configure_exporter(doku_ingester.url, "key", compression="zstd", http2=True,
+                                  batch_size=0)
+    assert (exporter.compression, exporter.http2, exporter.batch_size) == ("gzip", False, 1)
+
+    assert configure_exporter(doku_ingester.url, "key", compression="zstd", http2=True) is exporter
+    replaced = configure_exporter(doku_ingester.url, "key", compression="gzip")
+    assert replaced is not exporter
+    replaced.shutdown(timeout=5)
+
+def _enqueue_in_child(exporter):
+    exporter.enqueue({"llmReqId": "child"})
+    sys.exit(0 if exporter.flush(timeout=5) else 1)
+
+def test_forked_child_rebuilds_exporter(doku_ingester):
+    """
+    Test that a forked child gets a working exporter and does not resend the parent's data.
+    """
+    exporter = configure_exporter(doku_ingester.url, "key", flush_interval=60)
+    exporter.start()
+    exporter.enqueue({"llmReqId": "parent"})
+
+    child = multiprocessing.get_context("fork").Process(target=_enqueue_in_child,
+                                                       args=(exporter,))
+    child.start()
+    child.join(timeout=10)
+    assert child.exitcode == 0
+
+    assert exporter.flush(timeout=5)
+    assert sorted(event["llmReqId"] for event in doku_ingester.events) == ["child", "parent"]
+    exporter.shutdown(timeout=5)
+
+def test_events_too_large_for_agent_pushed_to_doku(doku_ingester):
+    """
+    Test that events over the datagram limit bypass the agent, and are counted without Doku.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as agent:
+        agent.bind(("127.0.0.1", 0))
+        agent.settimeout(5)
+        listen = f"udp://127.0.0.1:{agent.getsockname()[1]}"
+        exporter = Exporter(doku_ingester.url, "key", agent_url=listen)
+        exporter.enqueue({"llmReqId": "small"})
+        exporter.enqueue({"llmReqId": "large", "prompt": "x" * 100000})
+        assert exporter.flush(timeout=5)
+
+        assert agent.recv(65536) == b'{"llmReqId":"small"}'
+        assert [event["llmReqId"] for event in doku_ingester.events] == ["large"]
+        exporter.shutdown(timeout=5)
+
+        exporter = Exporter(None, None, agent_url=listen)
+        exporter.enqueue({"llmReqId": "large", "prompt": "x" * 100000})
+        assert exporter.flush(timeout=5)
+        assert exporter.stats()["oversized"] == 1
+        exporter.shutdown(timeout=5)
+
+@pytest.mark.parametrize("listen", ["unix", "udp"])
+def test_agent_forwards_events_from_processes(doku_ingester, tmp_path, listen):
+    """
+    Test that events sent to a local agent are forwarded to Doku in bulk.
+    """
+    if listen == "unix":
+        listen = f"unix://{tmp_path}/dokumetry.sock"
+    else:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(("127.0.0.1", 0))
+            listen = f"udp://127.0.0.1:{probe.getsockname()[1]}"
+    agent_exporter = Exporter(doku_ingester.url, "key", bulk_push=True, flush_interval=0.05)
+    stop_event, ready_event = threading.Event(), threading.Event()
+    agent = threading.Thread(target=serve, args=(listen, agent_exporter, stop_event, ready_event))
+    agent.start()
+    assert ready_event.wait(5)
+
+    exporter = Exporter(None, None, agent_url=listen)
+    for i in range(5):
+        exporter.enqueue({"llmReqId": i})
+    assert exporter.flush(timeout=5)
+
+    assert doku_ingester.wait_for(5)
+    stop_event.set()
+    agent.join(timeout=10)
+    assert [event["llmReqId"] for event in doku_ingester.events] == [0, 1, 2, 3, 4]
+    assert doku_ingester.requests[0]["Authorization"] == "key"
+    exporter.shutdown(timeout=5)
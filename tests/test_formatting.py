@@ -0,0 +1,79 @@
+"""
+Formatting Test Suite
+
+This module contains tests for the formatting of chat messages and embedding
+inputs into the prompt sent to Doku, shared by all wrappers.
+"""
+
+import base64
+from types import SimpleNamespace as Fake
+from dokumetry.__formatting import (describe_inputs, format_messages, LONG_CONTENT_CHARS,
+                                    PREVIEW_CHARS)
+from dokumetry.__media import sampled_hash
+
+def test_format_messages_with_dicts_and_items():
+    """
+    Test that dict messages with text and list contents are formatted one per line.
+    """
+    messages = [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": [{"type": "text", "text": "What is this?"},
+                                     {"type": "image_url", "image_url": "https://a.b/c.png"}]},
+    ]
+
+    assert format_messages(messages) == (
+        "system: Be brief.\nuser: text: What is this?, image_url: https://a.b/c.png")
+
+def test_format_messages_with_objects_and_long_content():
+    """
+    Test that message objects and long contents are formatted with a custom separator.
+    """
+    long_content = "x" * LONG_CONTENT_CHARS
+    messages = [Fake(role="user", content="Hi"), Fake(role="assistant", content=long_content),
+                Fake(role="user", content="Thanks")]
+
+    assert format_messages(messages, " ") == f"user: Hi assistant: {long_content} user: Thanks"
+    assert format_messages([]) == ""
+
+def test_format_messages_without_content():
+    """
+    Test that messages without content, such as tool calls, are formatted.
+    """
+    messages = [{"role": "user", "content": [{"type": "text", "text": "data: 3 rows"}]},
+                {"role": "assistant", "tool_calls": [{"id": "call_1"}]}]
+
+    assert format_messages(messages) == "user: text: data: 3 rows\nassistant: None"
+
+def test_describe_inputs_counts_and_samples():
+    """
+    Test that embedding inputs are counted and only a few short previews are kept.
+    """
+    texts = [f"document {i} " + "x" * 1000 for i in range(1000)]
+    fields = describe_inputs(texts)
+
+    assert fields["inputCount"] == 1000
+    assert fields["inputChars"] == sum(len(text) for text in texts)
+    previews = fields["prompt"].split(", ")
+    assert [preview[:12] for preview in previews] == ["document 0 x", "document 333",
+                                                      "document 666"]
+    assert all(len(preview) == PREVIEW_CHARS for preview in previews)
+
+    assert describe_inputs("hello", previews=0) == {"inputCount": 1, "inputChars": 5, "prompt": ""}
+    assert describe_inputs([[1, 2, 3], [4]]) == {"inputCount": 2, "inputTokens": 4, "prompt": ""}
+    assert describe_inputs([1, 2, 3]) == {"inputCount": 1, "inputTokens": 3, "prompt": ""}
+
+def test_inline_images_described_not_copied():
+    """
+    Test that data URIs and base64 sources are replaced by their type, size and hash.
+    """
+    encoded = base64.b64encode(bytes(100001)).decode()
+    messages = [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encoded}"}},
+        {"type": "image", "source": {"type": "base64", "media_type": "image/png",
+                                     "data": encoded}},
+        {"type": "image_url", "image_url": {"url": "https://a.b/c.png", "detail": "low"}}]}]
+
+    prompt = format_messages(messages)
+    described = f"[image/png, 100001 bytes, {sampled_hash(encoded)}]"
+    assert prompt == (f"user: image_url: {described}, image: {described}, "
+                      "image_url: https://a.b/c.png")
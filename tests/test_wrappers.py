@@ -0,0 +1,590 @@
+"""
+Wrapper Test Suite
+
+This module contains tests for the data the wrappers collect, including the
+handling of streamed responses. The wrappers are applied to fake clients
+returning prebuilt responses and chunks, and the data is sent to a local
+stand-in for the Doku Ingester (see `conftest.py`), so no LLM API keys are
+needed.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from types import SimpleNamespace as Fake
+import pytest
+import dokumetry
+from dokumetry import openai as doku_openai
+from dokumetry.__exporter import get_exporter
+from dokumetry.__media import describe_images, sampled_hash
+from dokumetry.__stream import AsyncTracedStream, StreamAccumulator
+
+def unused(*_args, **_kwargs):
+    """
+    Stand in for the client methods a test does not call.
+    """
+
+def fake_openai(chunks):
+    """
+    Build a fake OpenAI client whose chat completions stream `chunks`, a list
+    or a generator function, or return `chunks` when it is a response.
+    """
+
+    def create(*_args, **_kwargs):
+        if isinstance(chunks, Fake):
+            return chunks
+        return iter(chunks) if isinstance(chunks, list) else chunks()
+    return Fake(chat=Fake(completions=Fake(create=create)), completions=Fake(create=unused),
+                embeddings=Fake(create=unused), fine_tuning=Fake(jobs=Fake(create=unused)),
+                images=Fake(generate=unused, create_variation=unused),
+                audio=Fake(speech=Fake(create=unused)))
+
+def test_accumulator_counts_words_across_chunks():
+    """
+    Test that words split over chunks are counted once when the text is not kept.
+    """
+    accumulator = StreamAccumulator(capture_response=False, count_words=True)
+    for text in ["Hel", "lo wor", "ld, how ", "are", " you", None, ""]:
+        accumulator.add(text)
+
+    assert accumulator.text() is None
+    assert accumulator.word_count() == 5
+    assert accumulator.response_fields() == {"responseChunks": 5, "responseBytes": 24}
+
+def test_stream_without_response_capture(doku_ingester):
+    """
+    Test that a stream reports chunks and bytes instead of the response text.
+    """
+    chunks = [Fake(id="chatcmpl-1", choices=[Fake(delta=Fake(content=text))])
+              for text in ["café", " au", " lait", None]]
+    llm = fake_openai(chunks)
+    doku_openai.init(llm, doku_ingester.url, "key", "test", "test", False,
+                     capture_response=False)
+
+    stream = llm.chat.completions.create(model="gpt-3.5-turbo", stream=True,
+                                         messages=[{"role": "user", "content": "Coffee?"}])
+    assert list(stream) == chunks
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    event = doku_ingester.events[0]
+    assert "response" not in event
+    assert event["responseChunks"] == 3
+    assert event["responseBytes"] == 13
+    assert event["prompt"] == "user: Coffee?"
+
+def test_stream_latency_metrics(doku_ingester):
+    """
+    Test that streams report the time to the first chunk and the gaps between chunks.
+    """
+    def chunks():
+        time.sleep(0.2)
+        yield Fake(id="chatcmpl-2", choices=[Fake(delta=Fake(content="Hello"))])
+        time.sleep(0.1)
+        yield Fake(id="chatcmpl-2", choices=[Fake(delta=Fake(content=" there"))])
+        yield Fake(id="chatcmpl-2", choices=[Fake(delta=Fake(content="!"))])
+
+    llm = fake_openai(chunks)
+    doku_openai.init(llm, doku_ingester.url, "key", "test", "test", False)
+    for _ in llm.chat.completions.create(model="gpt-3.5-turbo", stream=True,
+                                         messages=[{"role": "user", "content": "Hi"}]):
+        pass
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    event = doku_ingester.events[0]
+    assert event["response"] == "Hello there!"
+    assert 0.2 <= event["timeToFirstChunk"] < event["requestDuration"]
+    assert 0.1 <= event["interChunkGapMax"] < 0.2
+    assert event["interChunkGapMean"] == pytest.approx(event["interChunkGapMax"] / 2, rel=0.1)
+    assert event["chunksPerSecond"] == pytest.approx(1 / event["interChunkGapMean"])
+
+def test_multiple_choices_sent_as_one_event(doku_ingester):
+    """
+    Test that a completion with n > 1 choices is sent once with all choices.
+    """
+    choices = [Fake(message=Fake(content=f"Answer {i}"), finish_reason="stop") for i in range(3)]
+    response = Fake(id="chatcmpl-3", choices=choices,
+                    usage=Fake(completion_tokens=6, prompt_tokens=4, total_tokens=10))
+    llm = fake_openai(response)
+    doku_openai.init(llm, doku_ingester.url, "key", "test", "test", False)
+    assert llm.chat.completions.create(model="gpt-3.5-turbo", n=3,
+                                       messages=[{"role": "user", "content": "Hi"}]) is response
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    assert len(doku_ingester.events) == 1
+    event = doku_ingester.events[0]
+    assert event["response"] == "Answer 0"
+    assert event["totalTokens"] == 10
+    assert event["choices"] == [{"response": f"Answer {i}", "finishReason": "stop"}
+                                for i in range(3)]
+
+def test_base64_images_sent_as_sizes_and_hashes(doku_ingester):
+    """
+    Test that base64 images are sent as one event with their sizes and hashes only.
+    """
+    response = Fake(created=1700000000, data=[
+        Fake(b64_json="aGVsbG8=", revised_prompt="A red cat", url=None),
+        Fake(b64_json="d29ybGQh", revised_prompt="A red cat", url=None)])
+    llm = fake_openai([])
+    llm.images.generate = lambda *_args, **_kwargs: response
+    doku_openai.init(llm, doku_ingester.url, "key", "test", "test", False)
+
+    assert llm.images.generate(model="dall-e-2", prompt="A cat", n=2,
+                               response_format="b64_json") is response
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    assert len(doku_ingester.events) == 1
+    event = doku_ingester.events[0]
+    assert "image" not in event and "images" not in event
+    assert event["imageCount"] == 2
+    assert event["imageBytes"] == [5, 6]
+    assert event["imageHashes"] == [sampled_hash("aGVsbG8="), sampled_hash("d29ybGQh")]
+    assert event["revisedPrompt"] == "A red cat"
+
+def test_captured_images_sent_once():
+    """
+    Test that captured images and URLs are sent as "image" for one image, "images" for several.
+    """
+    images = [Fake(b64_json="aGVsbG8=", url=None), Fake(b64_json="d29ybGQh", url=None)]
+
+    fields = describe_images(images, "b64_json", capture_images=True)
+    assert "image" not in fields and fields["images"] == ["aGVsbG8=", "d29ybGQh"]
+    fields = describe_images(images[:1], "b64_json", capture_images=True)
+    assert fields["image"] == "aGVsbG8=" and "images" not in fields
+    assert describe_images([Fake(url="https://a.b/c.png")], "url") == {
+        "imageCount": 1, "image": "https://a.b/c.png"}
+
+def test_audio_bytes_and_throughput(doku_ingester):
+    """
+    Test that speech events report the size of the audio read and the bytes per second.
+    """
+    response = Fake(response=Fake(is_closed=True, content=bytes(48000)))
+    llm = fake_openai([])
+    llm.audio.speech.create = lambda *_args, **_kwargs: (time.sleep(0.1), response)[1]
+    doku_openai.init(llm, doku_ingester.url, "key", "test", "test", False)
+
+    assert llm.audio.speech.create(model="tts-1", voice="alloy", input="Hello") is response
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    event = doku_ingester.events[0]
+    assert event["audioBytes"] == 48000
+    assert 0 < event["audioBytesPerSecond"] <= 480000
+    assert event["audioVoice"] == "alloy"
+
+def _speech_http_client(http, size, delay, is_async=False):
+    """
+    Return a client of `http` answering every request with `size` bytes of audio,
+    streamed in chunks of 1000 bytes with `delay` seconds between them.
+    """
+    chunks = [bytes(min(1000, size - start)) for start in range(0, size, 1000)]
+
+    if is_async:
+        async def body():
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                yield chunk
+        return http.AsyncClient(transport=http.MockTransport(
+            lambda request: http.Response(200, content=body())))
+
+    def sync_body():
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+    return http.Client(transport=http.MockTransport(
+        lambda request: http.Response(200, content=sync_body())))
+
+def test_streamed_audio_counted_as_read(doku_ingester, tmp_path):
+    """
+    Test that speech streamed by the caller is counted as it is read, and sent
+    once the response is closed, with the time taken to stream it.
+    """
+    openai = pytest.importorskip("openai")
+    http = sys.modules[openai.DefaultHttpxClient.__mro__[1].__module__]
+    llm = openai.OpenAI(api_key="key", http_client=_speech_http_client(http, 12345, 0.01))
+    doku_openai.init(llm, doku_ingester.url, "key", "test", "test", False)
+
+    with llm.audio.speech.with_streaming_response.create(
+            model="tts-1", voice="alloy", input="Hello") as response:
+        response.stream_to_file(tmp_path / "speech.mp3")
+        assert not doku_ingester.events
+    with llm.audio.speech.with_streaming_response.create(
+            model="tts-1", voice="echo", input="Hello") as response:
+        assert sum(len(chunk) for chunk in response.iter_bytes()) == 12345
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    assert (tmp_path / "speech.mp3").stat().st_size == 12345
+    assert [event["audioVoice"] for event in doku_ingester.events] == ["alloy", "echo"]
+    for event in doku_ingester.events:
+        assert event["audioBytes"] == 12345
+        assert event["requestDuration"] >= 0.1
+        assert event["audioBytesPerSecond"] == 12345 / event["requestDuration"]
+
+def test_async_streamed_audio_counted_as_read(doku_ingester):
+    """
+    Test that speech streamed by the caller of an async client is counted as it is read.
+    """
+    openai = pytest.importorskip("openai")
+    http = sys.modules[openai.DefaultHttpxClient.__mro__[1].__module__]
+    llm = openai.AsyncOpenAI(api_key="key",
+                             http_client=_speech_http_client(http, 12345, 0.01, is_async=True))
+    dokumetry.init(llm, doku_ingester.url, "key")
+
+    async def stream_speech():
+        async with llm.audio.speech.with_streaming_response.create(
+                model="tts-1", voice="alloy", input="Hello") as response:
+            return sum([len(chunk) async for chunk in response.iter_bytes()])
+
+    assert asyncio.run(stream_speech()) == 12345
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    assert len(doku_ingester.events) == 1
+    assert doku_ingester.events[0]["audioBytes"] == 12345
+    assert doku_ingester.events[0]["requestDuration"] >= 0.1
+
+class FakeStream:
+    """
+    Stand in for an SDK stream, recording when it is closed.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.response = Fake(status_code=200)
+        self.closed = 0
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        """
+        Release the connection.
+        """
+        self.closed += 1
+
+def test_stream_closed_early_sends_partial_data(doku_ingester):
+    """
+    Test that leaving a stream early closes the SDK stream and sends what was received.
+    """
+    chunks = [Fake(id="chatcmpl-4", choices=[Fake(delta=Fake(content=text))])
+              for text in ["One", " two", " three"]]
+    upstream = FakeStream(chunks)
+    llm = fake_openai(lambda: upstream)
+    doku_openai.init(llm, doku_ingester.url, "key", "test", "test", False)
+
+    with llm.chat.completions.create(model="gpt-3.5-turbo", stream=True,
+                                     messages=[{"role": "user", "content": "Count"}]) as stream:
+        assert stream.response.status_code == 200
+        for chunk in stream:
+            if chunk.choices[0].delta.content == " two":
+                break
+        assert upstream.closed == 0
+    assert upstream.closed >= 1
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    assert len(doku_ingester.events) == 1
+    assert doku_ingester.events[0]["response"] == "One two"
+    assert doku_ingester.events[0]["llmReqId"] == "chatcmpl-4"
+
+def test_async_stream_close():
+    """
+    Test that closing an async stream proxy closes the wrapper's generator and the SDK stream.
+    """
+    closed = []
+
+    class FakeAsyncStream: # pylint: disable=too-few-public-methods
+        """
+        Stand in for an async SDK stream.
+        """
+
+        async def close(self):
+            """
+            Release the connection.
+            """
+            closed.append("stream")
+
+    async def chunks():
+        try:
+            yield 1
+            yield 2
+        finally:
+            closed.append("generator")
+
+    async def consume():
+        async with AsyncTracedStream(FakeAsyncStream(), chunks()) as stream:
+            async for chunk in stream:
+                assert chunk == 1
+                break
+        return closed
+
+    assert asyncio.run(consume()) == ["generator", "stream"]
+
+def test_import_loads_no_provider_sdk():
+    """
+    Test that importing dokumetry does not import any provider SDK, or httpx.
+    """
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, dokumetry; print(sorted(m for m in sys.modules "
+                               "if m.split('.')[0] in ('openai', 'anthropic', 'mistralai', "
+                               "'httpx')))"],
+        capture_output=True, text=True, check=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}).stdout.strip()
+
+    assert loaded == "[]"
+
+def test_init_recognises_clients_by_class_name(doku_ingester):
+    """
+    Test that init instruments a client from the name of its class and package.
+    """
+    # pylint: disable=no-member
+    anthropic_client = type("Anthropic", (), {"__module__": "anthropic._client"})
+    llm = type("Custom", (anthropic_client,), {})()
+    llm.messages = Fake(create=unused)
+    dokumetry.init(llm, doku_ingester.url, "key")
+
+    assert llm.messages.create is not unused
+    assert "dokumetry.anthropic" in sys.modules
+
+def test_azure_client_on_custom_domain(doku_ingester):
+    """
+    Test that Azure clients are routed by class, whatever the domain they call.
+    """
+    # pylint: disable=no-member
+    openai_client = type("OpenAI", (), {"__module__": "openai._client"})
+    azure_client = type("AzureOpenAI", (openai_client,), {"__module__": "openai.lib.azure"})
+    response = Fake(id="chatcmpl-5", model="gpt-4", choices=[Fake(message=Fake(content="Hi"),
+                                                                  finish_reason="stop")],
+                    usage=Fake(completion_tokens=1, prompt_tokens=1, total_tokens=2))
+    llm = azure_client()
+    llm.__dict__.update(vars(fake_openai(response)))
+    llm.base_url = "https://llm.example.com/openai/"
+    dokumetry.init(llm, doku_ingester.url, "key")
+
+    llm.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": "Hi"}])
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+    assert doku_ingester.events[0]["endpoint"] == "azure.chat.completions"
+
+def test_registered_instrumentation_found_once_per_class(doku_ingester):
+    """
+    Test that a registered instrumentation is used for its class and its subclasses.
+    """
+    calls = []
+
+    def init_acme(llm, *_args, capture_response=True):
+        calls.append((llm.__class__.__name__, capture_response))
+
+    acme_client = type("AcmeClient", (), {"__module__": "acme.client"})
+    dokumetry.register_instrumentation("acme.AcmeClient", init_acme)
+    tenant_client = type("TenantClient", (acme_client,), {})
+    dokumetry.init(acme_client(), doku_ingester.url, "key", capture_response=False)
+    dokumetry.init(tenant_client(), doku_ingester.url, "key", capture_images=True)
+
+    assert calls == [("AcmeClient", False), ("TenantClient", True)]
+
+def test_class_level_instrumentation(doku_ingester):
+    """
+    Test that instrumenting the classes tracks clients never passed to init, with
+    the settings of the clients that were.
+    """
+    # pylint: disable=no-member
+    response = Fake(id="msg_1", stop_reason="end_turn", content=[Fake(text="Hi")],
+                    usage=Fake(input_tokens=3, output_tokens=1))
+
+    class Messages: # pylint: disable=too-few-public-methods
+        """
+        Stand in for the messages resource of the Anthropic SDK.
+        """
+
+        def __init__(self, client):
+            self._client = client
+
+        def create(self, **_kwargs):
+            """
+            Return the response.
+            """
+            return response
+
+    def client_init(self):
+        self.messages = Messages(self)
+    anthropic_client = type("Anthropic", (), {"__module__": "anthropic._client",
+                                              "__init__": client_init})
+    dokumetry.init(anthropic_client(), doku_ingester.url, "key", instrument_classes=True)
+    tenant = anthropic_client()
+    dokumetry.init(tenant, doku_ingester.url, "key", application_name="tenant",
+                   instrument_classes=True)
+
+    assert "create" not in vars(anthropic_client().messages)
+    assert anthropic_client().messages.create(model="claude-3", messages=[]) is response
+    assert tenant.messages.create(model="claude-3", messages=[]) is response
+    assert anthropic_client().messages.create(
+        model="claude-3", messages=[],
+        extra_headers={"X-Stainless-Raw-Response": "true"}) is response
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+
+    assert [event["applicationName"] for event in doku_ingester.events] == ["default", "tenant"]
+
+def test_init_twice_and_uninstrument(doku_ingester):
+    """
+    Test that initializing a client twice tracks each call once, with the last
+    settings, and that uninstrument restores the client's methods.
+    """
+    # pylint: disable=no-member
+    response = Fake(id="chatcmpl-6", choices=[Fake(message=Fake(content="Hi"),
+                                                   finish_reason="stop")],
+                    usage=Fake(completion_tokens=1, prompt_tokens=1, total_tokens=2))
+    openai_client = type("OpenAI", (Fake,), {"__module__": "openai._client"})
+    llm = openai_client(**vars(fake_openai(response)))
+    original = llm.chat.completions.create
+    dokumetry.init(llm, doku_ingester.url, "key")
+    dokumetry.init(llm, doku_ingester.url, "key", application_name="again")
+
+    llm.chat.completions.create(model="gpt-4", messages=[])
+    assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+    assert [event["applicationName"] for event in doku_ingester.events] == ["again"]
+
+    assert dokumetry.uninstrument(llm)
+    assert llm.chat.completions.create is original
+    assert llm.images.generate is unused
+    assert not dokumetry.uninstrument(llm)
+
+def test_uninstrument_classes(doku_ingester):
+    """
+    Test that uninstrumenting a client initialized with instrument_classes
+    restores the classes of its SDK.
+    """
+    # pylint: disable=no-member
+    class Messages: # pylint: disable=too-few-public-methods
+        """
+        Stand in for the messages resource of the Anthropic SDK.
+        """
+
+        def __init__(self, client):
+            self._client = client
+
+        def create(self, **_kwargs):
+            """
+            Return nothing.
+            """
+
+    def client_init(self):
+        self.messages = Messages(self)
+    anthropic_client = type("AsyncAnthropic", (), {"__module__": "anthropic._client",
+                                                   "__init__": client_init})
+    original = Messages.create
+    llm = anthropic_client()
+    dokumetry.init(llm, doku_ingester.url, "key", instrument_classes=True)
+    assert Messages.create is not original
+    dokumetry.init(llm, doku_ingester.url, "key")
+    assert "create" not in vars(llm.messages)
+
+    assert dokumetry.uninstrument(llm)
+    assert Messages.create is original
+
+def test_class_level_instrumentation_of_mistral_client(doku_ingester):
+    """
+    Test that each client of the Mistral SDK, whose methods are on the client class
+    itself, is tracked with its own settings.
+    """
+    httpx = pytest.importorskip("httpx")
+    mistral_client = pytest.importorskip("mistralai.client")
+    chat_completion = pytest.importorskip("mistralai.models.chat_completion")
+    body = {"id": "cmpl-1", "object": "chat.completion", "created": 1700000000,
+            "model": "mistral-small", "choices": [{"index": 0, "finish_reason": "stop",
+                                                   "message": {"role": "assistant",
+                                                               "content": "Hi"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}}
+
+    def new_client():
+        llm = mistral_client.MistralClient(api_key="key")
+        # pylint: disable=protected-access
+        llm._client = httpx.Client(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, json=body)))
+        return llm
+
+    dokumetry.init(new_client(), doku_ingester.url, "key", instrument_classes=True)
+    tenant = new_client()
+    dokumetry.init(tenant, doku_ingester.url, "key", application_name="tenant",
+                   instrument_classes=True)
+    messages = [chat_completion.ChatMessage(role="user", content="Hello")]
+    try:
+        assert new_client().chat(model="mistral-small", messages=messages).id == "cmpl-1"
+        tenant.chat(model="mistral-small", messages=messages)
+        assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+    finally:
+        dokumetry.uninstrument(tenant)
+
+    assert [event["applicationName"] for event in doku_ingester.events] == ["default", "tenant"]
+
+def _openai_clients(handler):
+    """
+    Return functions creating OpenAI and AzureOpenAI clients of the real SDK that
+    answer every request with `handler`.
+    """
+    openai = pytest.importorskip("openai")
+    # httpx, or the fork of it the SDK version uses.
+    http = sys.modules[openai.DefaultHttpxClient.__mro__[1].__module__]
+
+    def http_client():
+        return http.Client(transport=http.MockTransport(lambda request: http.Response(
+            200, json=handler(request))))
+
+    def openai_client():
+        return openai.OpenAI(api_key="key", http_client=http_client())
+
+    def azure_client():
+        return openai.AzureOpenAI(api_key="key", api_version="2024-02-01",
+                                  azure_endpoint="https://llm.example.com",
+                                  http_client=http_client())
+
+    return openai_client, azure_client
+
+def test_class_level_instrumentation_leaves_azure_clients_alone(doku_ingester):
+    """
+    Test that instrumenting the classes for OpenAI clients, whose resource classes
+    AzureOpenAI shares, does not track AzureOpenAI clients as OpenAI ones.
+    """
+    completion = {"id": "chatcmpl-7", "object": "chat.completion", "created": 1700000000,
+                  "model": "gpt-4", "choices": [{"index": 0, "finish_reason": "stop",
+                                                 "message": {"role": "assistant",
+                                                             "content": "Hi"}}],
+                  "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+    openai_client, azure_client = _openai_clients(lambda request: completion)
+    messages = [{"role": "user", "content": "Hi"}]
+    llm = openai_client()
+    dokumetry.init(llm, doku_ingester.url, "key", application_name="openai",
+                   instrument_classes=True)
+    azure = azure_client()
+    try:
+        azure.chat.completions.create(model="gpt-4", messages=messages)
+        openai_client().chat.completions.create(model="gpt-4", messages=messages)
+        dokumetry.init(azure, doku_ingester.url, "key", application_name="azure")
+        azure.chat.completions.create(model="gpt-4", messages=messages)
+        assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+    finally:
+        dokumetry.uninstrument(azure)
+        dokumetry.uninstrument(llm)
+
+    assert [(event["endpoint"], event["applicationName"]) for event in doku_ingester.events] == [
+        ("openai.chat.completions", "openai"), ("azure.chat.completions", "azure")]
+
+def test_uninstrument_other_client_class_keeps_classes(doku_ingester):
+    """
+    Test that uninstrumenting a client of a class that was never initialized
+    leaves the class-level instrumentation of other client classes in place.
+    """
+    completion = {"id": "chatcmpl-8", "object": "chat.completion", "created": 1700000000,
+                  "model": "gpt-4", "choices": [{"index": 0, "finish_reason": "stop",
+                                                 "message": {"role": "assistant",
+                                                             "content": "Hi"}}],
+                  "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+    openai_client, azure_client = _openai_clients(lambda request: completion)
+    llm = openai_client()
+    dokumetry.init(llm, doku_ingester.url, "key", instrument_classes=True)
+    try:
+        assert not dokumetry.uninstrument(azure_client())
+        openai_client().chat.completions.create(model="gpt-4",
+                                                messages=[{"role": "user", "content": "Hi"}])
+        assert get_exporter(doku_ingester.url, "key").flush(timeout=5)
+    finally:
+        assert dokumetry.uninstrument(llm)
+
+    assert [event["llmReqId"] for event in doku_ingester.events] == ["chatcmpl-8"]